@@ -1,6 +1,13 @@
 import os
 import sys
 import shutil
+import socket
+import argparse
+import threading
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from git import Repo
 from pydriller import Repository
 import re
@@ -11,38 +18,65 @@ from util.assoc_fixer import assoc_fixer
 from util.diff_fixer import process_diffs
 from util.extract_common_info import common_info
 from util.lines import fix_docstring_code_lines
+from util.blob_reader import BlobReader, decode_blob
+from util.history import walk_history, commits_since, docstring_candidates, commit_counts, blob_sizes, line_range_commits
+from util.path_filter import FILTER_PATHS, path_allowed
+from util.scheduler import DiskBudget, directory_size, file_costs, gil_enabled
+from util.partial_clone import fetch_python_blobs, partial_clone_stats, head_python_blobs, fetch_blobs, git_output, object_store_size
+from util.plan import append_report, estimate_file, seconds_per_cost, write_plan, write_plan_files
+from util.mirror_cache import update_mirror
+from util.extraction_cache import ExtractionCache, git_blob_sha
+from util.version_stream import FunctionsJsonWriter
+from util.version_refs import TextMaterializer, reference_version, changed_functions, is_reference
+from util.journal import Journal, project_unit, file_unit, STARTED, DONE, FAILED
+from util.workspace import WORKSPACES, TaskWorkspace, read_manifest
+from util.work_queue import WorkQueue, LeaseRenewer, merge_shards, shard_path
+from util.limits import LimitExceeded, MiningBudget, Quarantine, backoff_delay, run_with_limits
 
 last_commit = None
-
-def clone_repository(username, repository):
+blob_readers = {}  # one long-lived `git cat-file --batch` reader per repository
+extraction_cache = None  # the --extraction-cache of this process, see get_extraction_cache
+journal = None  # the --journal of the run, see get_journal
+quarantine = None  # the --quarantine list of the run, see get_quarantine
+RESYNC_ATTEMPTS = 3  # chunk starts after a change that --hunks tries to resume the previous split at
+VERSION_METADATA = ('commit_date_time', 'commit_sha', 'project', 'owner', 'filename', 'file_path', 'commit_message')
+INCREMENTAL_STATE_DIR = 'incremental-state'  # default --state-dir; delete_repo_folders leaves it, unlike the `_files` folders
+
+def clone_repository(username, repository, options=None):
     """
     Clone the repository if it does not exist
+    With --partial-clone, only the commits and trees are downloaded and nothing is checked out; the blobs of the
+    Python files are fetched later, in batches, by fetch_python_blobs
+    With --mirror-cache, the bare mirror of the project in the cache is created or brought up to date instead;
+    modes that never check anything out mine the mirror itself, the others get a --shared clone of it
 
     :param username: Username of the repository owner
     :param repository: Name of the repository
+    :param options: Parsed command line options
     """
-    repo_url = f'https://github.com/{username}/{repository}.git'
+    if options is None:
+        options = parse_arguments([])
+
+    repo_url = options.remote.format(username=username, repository=repository)
     repo_path = f'{username}_{repository}'
 
+    if options.mirror_cache:
+        mirror = update_mirror(options.mirror_cache, username, repository, repo_url, options.partial_clone)
+        if options.no_checkout:
+            return mirror
+        repo_url = mirror
+        if not os.path.exists(repo_path):
+            os.system(f'git clone --shared {repo_url} {repo_path}')
+        return repo_path
+
     if not os.path.exists(repo_path):
-        os.system(f'git clone {repo_url} {repo_path}')
+        if options.partial_clone:
+            os.system(f'git clone --filter=blob:none --no-checkout {repo_url} {repo_path}')
+        else:
+            os.system(f'git clone {repo_url} {repo_path}')
 
     return repo_path
 
-def find_and_files(directory, prefix):
-    """
-    Recursively search for files that begin with the given prefix in the specified directory.
-
-    :param directory: Directory to search for files
-    :param prefix: Prefix to match the files
-    """
-    matching_files = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.startswith(prefix):
-                matching_files.append(os.path.join(root, file))
-    return matching_files
-
 def get_last_commit(repo_path):
     """
     Get the last commit of the repository
@@ -52,7 +86,186 @@ def get_last_commit(repo_path):
     repo = Repo(repo_path)
     return repo.head.commit.hexsha
 
-def get_commits(username, repository, filename, repo_path=None):
+def get_blob_reader(repo_path):
+    """
+    Get the blob reader of the repository, starting it if it is not running yet
+
+    :param repo_path: Path to the cloned repository
+    """
+    if repo_path not in blob_readers:
+        blob_readers[repo_path] = BlobReader(repo_path)
+    return blob_readers[repo_path]
+
+def close_blob_readers(keep=None):
+    """
+    Stop all the running blob readers
+
+    :param keep: Path of a repository whose blob reader is left running
+    """
+    for repo_path in list(blob_readers):
+        if repo_path != keep:
+            blob_readers.pop(repo_path).close()
+
+def close_blob_reader(repo_path):
+    """
+    Stop the blob reader of a repository, under its path as given or as an absolute path
+
+    :param repo_path: Path to the cloned repository
+    """
+    for path in {repo_path, os.path.abspath(repo_path)}:
+        if path in blob_readers:
+            blob_readers.pop(path).close()
+
+def get_extraction_cache(options):
+    """
+    Get the extraction cache of the process, opening it if needed
+    Returns None if the run has no --extraction-cache
+
+    :param options: Parsed command line options
+    """
+    global extraction_cache
+    if options.extraction_cache is None:
+        return None
+    if extraction_cache is None:
+        extraction_cache = ExtractionCache(options.extraction_cache, int(options.extraction_cache_size * 1024 ** 3))
+    return extraction_cache
+
+def get_journal(options):
+    """
+    Get the journal of the run, opening (and replaying) it if needed
+
+    :param options: Parsed command line options
+    """
+    global journal
+    if journal is None:
+        journal = Journal(os.path.abspath(options.journal))
+    return journal
+
+def close_journal():
+    """
+    Close the journal of the run, if it was opened
+    """
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
+
+def get_quarantine(options):
+    """
+    Get the quarantine list of the run, loading it if needed
+
+    :param options: Parsed command line options
+    """
+    global quarantine
+    if quarantine is None:
+        quarantine = Quarantine(os.path.abspath(options.quarantine))
+    return quarantine
+
+def project_deadline(options):
+    """
+    This function returns the time.monotonic() deadline of a project that starts now, None without --project-timeout
+
+    :param options: Parsed command line options
+    """
+    return time.monotonic() + options.project_timeout if options.project_timeout else None
+
+def file_time_limit(options, deadline=None):
+    """
+    This function returns the wall-clock limit of a file in seconds, 0 if there is none:
+    the --file-timeout, cut short by the deadline of the project
+
+    :param options: Parsed command line options
+    :param deadline: Deadline of the project, see project_deadline
+    """
+    timeout = options.file_timeout
+    if deadline is not None:
+        remaining = max(deadline - time.monotonic(), 0.001)
+        timeout = min(timeout, remaining) if timeout else remaining
+    return timeout
+
+def check_deadline(deadline, options):
+    """
+    This function raises LimitExceeded once the deadline of the project has passed
+
+    :param deadline: Deadline of the project, see project_deadline
+    :param options: Parsed command line options
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        raise LimitExceeded(f'timed out after {options.project_timeout} seconds')
+
+def project_budget(options):
+    """
+    This function returns the MiningBudget of a project that starts now, None without --max-pairs, --max-commits and
+    --max-seconds
+
+    :param options: Parsed command line options
+    """
+    if not (options.max_pairs or options.max_commits or options.max_seconds):
+        return None
+    return MiningBudget(options.max_pairs, options.max_commits, options.max_seconds)
+
+def count_pairs(username, repository, filename):
+    """
+    This function counts the pairs a mined file emitted, i.e. the functions whose docstring and code changed together
+    between two versions, from the differ file in the folder of the file
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    """
+    differ_file = os.path.join(get_files_folder(username, repository, filename),
+                               f"differ_functions_{filename.replace('/', '_')}.txt")
+    if not os.path.exists(differ_file):
+        return 0
+    with open(differ_file, 'r', errors='replace') as diff_file:
+        return sum(1 for line in diff_file if line.startswith('Docstring and code changed for function '))
+
+def report_extraction_cache(options):
+    """
+    This function prints the hit and miss counters of the extraction cache at the end of the run
+
+    :param options: Parsed command line options
+    """
+    cache = get_extraction_cache(options)
+    if cache is not None:
+        counts = cache.counts()
+        print(f"Extraction cache: {counts['hits']} hits, {counts['misses']} misses, {counts['evictions']} evictions")
+
+def traverse_file_commits(repo_path, filename):
+    """
+    Traverse the commits that modified the file with pydriller, oldest first
+
+    :param repo_path: Path to the cloned repository
+    :param filename: Name of the file
+    """
+    # include_deleted_files only passes the path after `--`, so git finds it without a working tree too, as in a
+    # partial clone or a bare mirror
+    for commit in Repository(repo_path, filepath=filename, include_deleted_files=True).traverse_commits():
+        yield {
+            'commit_sha': commit.hash,
+            'commit_date_time': str(commit.committer_date),
+            'commit_message': commit.msg,
+        }
+
+def file_history(repo_path, filename, histories, options):
+    """
+    This function returns the commits of a file a worker process mines it from
+    pydriller rewrites .git/config on every traversal, so the workers cannot traverse the history of their files
+    themselves; without --single-pass the parent traverses it for them, the same way a serial run does
+
+    :param repo_path: Path to the cloned repository
+    :param filename: Name of the file
+    :param histories: Version streams of the files from walk_history with --single-pass; otherwise the histories
+                      traversed so far, which the traversal of the file is added to
+    :param options: Parsed command line options
+    """
+    if options.single_pass:
+        return histories.get(filename)
+    if filename not in histories:
+        histories[filename] = list(traverse_file_commits(repo_path, filename))
+    return histories[filename]
+
+def get_commits(username, repository, filename, repo_path=None, options=None, history=None):
     """
     Get the commits for the file and save the functions and their docstrings in a JSON file
     Writes other metadata like commit date time, commit SHA, project name, owner, filename and file path to the JSON file as well
@@ -62,48 +275,400 @@ def get_commits(username, repository, filename, repo_path=None):
     :param repository: Name of the repository
     :param filename: Name of the file
     :param repo_path: Path to the cloned repository
+    :param options: Parsed command line options
+    :param history: Version stream of the file from walk_history; if not provided, the history of the file is traversed with pydriller
     """
 
     global last_commit
 
+    if options is None:
+        options = parse_arguments([])
+
     # reclone the repository if the repo_path is not provided
-    repo_path = clone_repository(username, repository)
+    if repo_path is None or not os.path.exists(repo_path):
+        repo_path = clone_repository(username, repository, options)
 
     # get the last commit of the repository
     last_commit = get_last_commit(repo_path)
 
     print(f"Last commit: {last_commit}")
 
+    # read the versions from the object database instead of resetting the working tree
+    blob_reader = get_blob_reader(repo_path) if options.no_checkout else None
+    # with --hunks each version only re-parses the lines that changed since the previous one
+    hunk_state = {} if options.hunks else None
+    # with --references the versions are kept as references into the object database, see util.version_refs
+    materializer = TextMaterializer(blob_reader, split_comments_and_code, get_extraction_cache(options)) if options.references else None
+
     version_count = 1  # Initialize version count
 
     all_functions = {}  # Dictionary to store all functions and their docstrings
 
-    for commit in Repository(repo_path, filepath=filename).traverse_commits():
-        commit_sha = commit.hash
-        commit_date_time = str(commit.committer_date)
-        commit_message = commit.msg
-        print(f"Commit SHA: {commit_sha}")
-        function = download_file_at_commit(repo_path, commit_sha, filename, version_count)
-        all_functions["v" + str(version_count)] = function
-        # add commit date time to the function dictionary
-        if all_functions["v" + str(version_count)] is not None:
-            all_functions["v" + str(version_count)]["commit_date_time"] = commit_date_time
-            all_functions["v" + str(version_count)]["commit_sha"] = commit_sha
-            all_functions["v" + str(version_count)]["project"] = repository
-            all_functions["v" + str(version_count)]["owner"] = username
-            all_functions["v" + str(version_count)]["filename"] = filename
-            all_functions["v" + str(version_count)]["file_path"] = str(os.path.join(repo_path, filename)).split(repo_path + '/')[1]
-            all_functions["v" + str(version_count)]["commit_message"] = commit_message
+    if history is None:
+        history = traverse_file_commits(repo_path, filename)
+
+    files_folder = get_files_folder(username, repository, filename)
+    state = load_incremental_state(files_folder, options) if options.incremental else None
+    if state is not None:
+        new_commits = commits_since(repo_path, state['last_commit'])
+        if new_commits is None:
+            print(f"Commit {state['last_commit']} is gone, mining file {filename} from scratch")
+            if os.path.exists(files_folder):
+                shutil.rmtree(files_folder)
+            state = None
+        else:
+            history = [commit for commit in history if commit['commit_sha'] in new_commits]
+            if not history:
+                print(f"No new commits for file: {filename}")
+                state['last_commit'] = last_commit
+                save_incremental_state(state, files_folder, options)
+                return
+            # carry on from the last mined version; the new files are appended to the ones already in the folder, if
+            # it was not deleted at the end of the last run, after its pairs went into differ_files
+            if os.path.exists(files_folder):
+                reopen_files_folder(files_folder)
+            version_count = state['version_count'] + 1
+            all_functions[f"v{state['version_count']}"] = convert_snapshot(state['snapshot'], materializer, repo_path, filename)
+
+    json_file = f"functions_{filename.replace('/', '_')}.json"
+    references_file = f"references_{filename.replace('/', '_')}.json"
+
+    # with --streaming only the previous version is kept in memory; every version is compared with the previous one
+    # as soon as it is extracted, and only the versions taking part in a change are kept for the JSON file
+    previous_version = all_functions.get(f"v{version_count - 1}")
+    if options.streaming:
+        previous_functions = {}
+        if state is not None and os.path.exists(json_file):
+            with open(json_file, 'r') as function_file:
+                previous_functions = json.load(function_file)
+        function_writer = None
+        if options.full_history_json and options.references:
+            # the full history is kept as reference records, in a file of its own next to the pairs
+            previous_references = {}
+            if state is not None and os.path.exists(references_file):
+                with open(references_file, 'r') as references:
+                    previous_references = json.load(references)
+            function_writer = FunctionsJsonWriter(references_file, indent=None)
+            for key, value in previous_references.items():
+                function_writer.write(key, value)
+        elif options.full_history_json:
+            function_writer = FunctionsJsonWriter(json_file)
+            for key, value in previous_functions.items():
+                function_writer.write(key, value)
+            previous_functions = {}
+        changed_versions = previous_functions
+
+    for commit, function in extract_versions(repo_path, filename, history, version_count, options, blob_reader, hunk_state):
+        commit_sha = commit['commit_sha']
+        if function is not None:
+            add_version_metadata(function, commit, username, repository, filename, repo_path)
+        if materializer is not None:
+            if function is not None:
+                blob_sha = commit.get('blob_sha') or blob_reader.read_file(commit_sha, filename)[0]
+                materializer.remember(blob_sha, function)
+                function = reference_version(function, blob_sha, VERSION_METADATA)
+            if function_writer is not None:
+                function_writer.write("v" + str(version_count), function)
+            compare_references(previous_version, function, version_count - 1, json_file, materializer, changed_versions)
+            previous_version = function
+        elif options.streaming:
+            if function_writer is not None:
+                function_writer.write("v" + str(version_count), function)
+            changed = compare_versions(previous_version, function, version_count - 1, json_file)
+            if changed:
+                keep_changed_functions(changed_versions, version_count - 1, previous_version, changed)
+                keep_changed_functions(changed_versions, version_count, function, changed)
+            previous_version = function
+        else:
+            all_functions["v" + str(version_count)] = function
         version_count += 1  # Increment version count
 
-    # write out the function dictionary to a file
-    with open(f"functions_{filename.replace('/', '_')}.json", 'w') as function_file:
-        json.dump(all_functions, function_file, indent=4)
+    if options.streaming:
+        if function_writer is not None:
+            function_writer.close()
+        if function_writer is None or materializer is not None:
+            with open(json_file, 'w') as function_file:
+                json.dump(changed_versions, function_file, indent=4)
+    else:
+        if state is not None and os.path.exists(json_file):
+            # add the new versions to the ones mined by the previous runs
+            with open(json_file, 'r') as function_file:
+                previous_functions = json.load(function_file)
+            previous_functions.update(all_functions)
+            all_functions = previous_functions
+
+        # write out the function dictionary to a file
+        with open(json_file, 'w') as function_file:
+            json.dump(all_functions, function_file, indent=4)
+
+        what_changed_between_versions(json_file, state['version_count'] if state else 1)
+        previous_version = all_functions.get(f"v{version_count - 1}")
+
+    if options.incremental:
+        save_incremental_state({
+            'last_commit': last_commit,
+            'version_count': version_count - 1,
+            'snapshot': previous_version,
+        }, files_folder, options)
+    # the working tree was never touched when reading blobs, so there is nothing to reset
+    clean_up(repo_path, filename, None if blob_reader else last_commit, get_files_folder(username, repository, filename))
+
+def extract_versions(repo_path, filename, history, first_version, options, blob_reader=None, hunk_state=None):
+    """
+    This function extracts the versions of a file in order, yielding every commit of the history together with the
+    functions of the file at that commit
+    With --version-workers above 1, a long history read from the object database is split into contiguous commit
+    ranges, which workers extract at the same time; the ranges are still yielded in order, so the versions are
+    compared and written exactly as if they were extracted one after the other
+    The workers are threads on an interpreter without the GIL and processes otherwise, see version_executor
 
-    what_changed_between_versions(f"functions_{filename.replace('/', '_')}.json")
-    clean_up(repo_path, filename, last_commit)
+    :param repo_path: Path to the cloned repository
+    :param filename: Name of the file
+    :param history: Commits of the file, oldest first
+    :param first_version: Number of the version of the first commit
+    :param options: Parsed command line options
+    :param blob_reader: Blob reader of the repository, see download_file_at_commit
+    :param hunk_state: State of split_comments_and_code_incremental for the file, see download_file_at_commit
+    """
+    ranges = None
+    if blob_reader is not None and options.version_workers > 1:
+        # the versions are only read from the object database, the working tree cannot be shared
+        history = list(history)
+        ranges = version_ranges(len(history), options.version_workers, options.version_chunk)
+    if not ranges or len(ranges) == 1:
+        for offset, commit in enumerate(history):
+            print(f"Commit SHA: {commit['commit_sha']}")
+            yield commit, download_file_at_commit(repo_path, commit['commit_sha'], filename, first_version + offset, blob_reader,
+                                                  commit.get('blob_sha'), get_extraction_cache(options), hunk_state,
+                                                  save_text=not options.references)
+        return
+
+    print(f"Extracting {len(history)} versions of {filename} in {len(ranges)} ranges")
+    with version_executor(options) as executor:
+        futures = [
+            executor.submit(extract_version_range, repo_path, filename, history[start:end], first_version + start, options)
+            for start, end in ranges
+        ]
+        for (start, end), future in zip(ranges, futures):
+            functions, cache_counts = future.result()
+            if cache_counts is not None:
+                get_extraction_cache(options).add_counts(cache_counts)
+            yield from zip(history[start:end], functions)
+
+def version_executor(options):
+    """
+    This function returns the pool of --version-workers workers that extract the ranges of versions
+    With --backend threads, or --backend auto on a free-threaded interpreter running without the GIL, the workers are
+    threads, which share the memory of the process and need no pickling; otherwise they are forked processes
 
-def download_file_at_commit(repo_path, commit_sha, filename, version_count):
+    :param options: Parsed command line options
+    """
+    if options.backend == 'threads' or (options.backend == 'auto' and not gil_enabled()):
+        return ThreadPoolExecutor(max_workers=options.version_workers)
+    return ProcessPoolExecutor(max_workers=options.version_workers, mp_context=multiprocessing.get_context('fork'),
+                               initializer=reset_worker_state)
+
+def version_ranges(count, workers, min_size):
+    """
+    This function splits the versions of a file into contiguous ranges of about the same size, at most one per
+    worker and each of at least min_size versions, so a history shorter than 2 * min_size is not split at all
+    Returns a list of (start, end) pairs of indexes
+
+    :param count: Number of versions
+    :param workers: Number of workers
+    :param min_size: Minimum number of versions in a range
+    """
+    if count == 0:
+        return []
+    ranges = max(1, min(workers, count // max(min_size, 1)))
+    bounds = [count * index // ranges for index in range(ranges + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+def extract_version_range(repo_path, filename, commits, first_version, options):
+    """
+    This function extracts a range of versions of a file in a worker of extract_versions
+    The text files of the versions are written to the current directory, which the worker shares with its parent
+    The range is read with a blob reader and an extraction cache of its own, so the threads of a pool never share one
+    Returns the functions of every version of the range, and the counters of the extraction cache for the range
+
+    :param repo_path: Path to the cloned repository
+    :param filename: Name of the file
+    :param commits: Commits of the range, oldest first
+    :param first_version: Number of the version of the first commit of the range
+    :param options: Parsed command line options
+    """
+    blob_reader = BlobReader(repo_path)
+    cache = None
+    if options.extraction_cache is not None:
+        cache = ExtractionCache(options.extraction_cache, int(options.extraction_cache_size * 1024 ** 3))
+    # the state of --hunks starts afresh at the start of every range
+    hunk_state = {} if options.hunks else None
+    functions = []
+    try:
+        for offset, commit in enumerate(commits):
+            print(f"Commit SHA: {commit['commit_sha']}")
+            functions.append(download_file_at_commit(repo_path, commit['commit_sha'], filename, first_version + offset, blob_reader,
+                                                     commit.get('blob_sha'), cache, hunk_state, save_text=not options.references))
+    finally:
+        blob_reader.close()
+    return functions, cache.counts() if cache is not None else None
+
+def add_version_metadata(function, commit, username, repository, filename, repo_path):
+    """
+    This function adds the metadata of the version to the functions of the version, see VERSION_METADATA
+
+    :param function: Functions of the version
+    :param commit: Commit of the version, with its SHA, date time and message
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    :param repo_path: Path to the cloned repository
+    """
+    function["commit_date_time"] = commit['commit_date_time']
+    function["commit_sha"] = commit['commit_sha']
+    function["project"] = repository
+    function["owner"] = username
+    function["filename"] = filename
+    function["file_path"] = str(os.path.join(repo_path, filename)).split(repo_path + '/')[1]
+    function["commit_message"] = commit['commit_message']
+
+def compare_references(current_reference, next_reference, version, json_file, materializer, changed_versions):
+    """
+    This function compares the reference records of two consecutive versions, for --references
+    The functions are compared by the hashes of their docstring and code; only the functions that changed are
+    materialized from the object database, compared with compare_versions and kept for the JSON file, see
+    keep_changed_functions
+
+    :param current_reference: Reference record of the version
+    :param next_reference: Reference record of the next version
+    :param version: Number of the version; the next version is version + 1
+    :param json_file: Name of the JSON file of the functions, which the text files are named after
+    :param materializer: TextMaterializer of the file
+    :param changed_versions: Dictionary of the versions kept so far
+    """
+    names = changed_functions(current_reference, next_reference)
+    if not names:
+        return
+    current_version = materializer.materialize(current_reference, names)
+    next_version = materializer.materialize(next_reference, names)
+    changed = compare_versions(current_version, next_version, version, json_file)
+    keep_changed_functions(changed_versions, version, current_version, changed)
+    keep_changed_functions(changed_versions, version + 1, next_version, changed)
+
+def convert_snapshot(snapshot, materializer, repo_path, filename):
+    """
+    This function returns the --incremental snapshot of a file in the representation of this run: a reference record
+    with --references, the functions of the version otherwise, whichever the previous run saved
+
+    :param snapshot: Snapshot of the last version mined, see load_incremental_state
+    :param materializer: TextMaterializer of the file with --references, None otherwise
+    :param repo_path: Path to the cloned repository
+    :param filename: Name of the file
+    """
+    if snapshot is None or is_reference(snapshot) == (materializer is not None):
+        return snapshot
+    blob_reader = get_blob_reader(repo_path)
+    if materializer is not None:
+        blob_sha, _ = blob_reader.read_file(snapshot['commit_sha'], filename)
+        materializer.remember(blob_sha, snapshot)
+        return reference_version(snapshot, blob_sha, VERSION_METADATA)
+    return TextMaterializer(blob_reader, split_comments_and_code).materialize(snapshot, list(snapshot['functions']))
+
+def keep_changed_functions(changed_versions, version, functions, changed):
+    """
+    This function keeps the changed functions of a version, with the metadata of the version, for the JSON file
+    --streaming writes; the differ files only ever look up the functions that changed
+
+    :param changed_versions: Dictionary of the versions kept so far
+    :param version: Number of the version
+    :param functions: Functions of the version
+    :param changed: Names of the functions that changed
+    """
+    kept = changed_versions.setdefault(f"v{version}", {})
+    for key in VERSION_METADATA:
+        kept[key] = functions[key]
+    for function_name in changed:
+        kept[function_name] = functions[function_name]
+
+def incremental_state_path(files_folder, options):
+    """
+    This function returns the path of the --incremental state of a file, in the --state-dir of the run, which
+    outlives the `_files` folder of the file
+
+    :param files_folder: The `_files` folder of the file
+    :param options: Parsed command line options
+    """
+    return os.path.join(options.state_dir, f'{files_folder}.json')
+
+def load_incremental_state(files_folder, options):
+    """
+    Load the state --incremental saved for a file: the commit the repository was at when the file was last mined,
+    the number of the last version and the functions of that version
+
+    Returns None if the file was never mined with --incremental
+
+    :param files_folder: The `_files` folder of the file
+    :param options: Parsed command line options
+    """
+    state_path = incremental_state_path(files_folder, options)
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as state_file:
+        return json.load(state_file)
+
+def save_incremental_state(state, files_folder, options):
+    """
+    Save the --incremental state of a file in the --state-dir of the run
+
+    :param state: State of the file, see load_incremental_state
+    :param files_folder: The `_files` folder of the file
+    :param options: Parsed command line options
+    """
+    os.makedirs(options.state_dir, exist_ok=True)
+    with open(incremental_state_path(files_folder, options), 'w') as state_file:
+        json.dump(state, state_file)
+
+def reopen_files_folder(files_folder):
+    """
+    Move the files of a `_files` folder back into the working directory and remove the folder,
+    so that a new run can append to them before clean_up moves them back
+
+    :param files_folder: The `_files` folder of the file
+    """
+    for file in os.listdir(files_folder):
+        shutil.move(os.path.join(files_folder, file), file)
+    os.rmdir(files_folder)
+
+def needs_processing(username, repository, file, options):
+    """
+    This function checks whether a file still has to be mined: either the journal does not record it as done,
+    or it was mined with --incremental and the run is incremental
+    A file the journal does not know of was mined before the journal was kept, so its `_files` folder is all there is
+    to go by; a file recorded as done whose `_files` folder is gone, as delete_repo_folders leaves it at the end of
+    every run, is mined again; a file in quarantine is not tried again
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param file: Name of the file
+    :param options: Parsed command line options
+    """
+    files_folder = get_files_folder(username, repository, file)
+    unit = file_unit(username, repository, file)
+    if unit in get_quarantine(options):
+        print(f"File: {file} is in quarantine, skipping it")
+        return False
+    state = get_journal(options).state(unit)
+    if state is None or state == DONE:
+        if not os.path.exists(files_folder):
+            return True
+    else:
+        # a run stopped in the middle of the file; whatever it left behind is incomplete, however complete it looks
+        if os.path.exists(files_folder) and not options.incremental:
+            shutil.rmtree(files_folder)
+        return True
+    return options.incremental and os.path.exists(incremental_state_path(files_folder, options))
+
+def download_file_at_commit(repo_path, commit_sha, filename, version_count, blob_reader=None, blob_sha=None, extraction_cache=None, hunk_state=None, save_text=True):
     """
     Download the file at the specified commit and save the comments and code in separate text files
     Also, split the comments and code and save them in separate files
@@ -112,13 +677,62 @@ def download_file_at_commit(repo_path, commit_sha, filename, version_count):
     :param commit_sha: Commit SHA to checkout
     :param filename: Name of the file
     :param version_count: Version count
+    :param blob_reader: Blob reader of the repository; if provided, the file is read from the object database
+                        and the working tree is left untouched
+    :param blob_sha: SHA of the blob of the file at the commit, if already known; only used with a blob reader
+    :param extraction_cache: ExtractionCache looked up by the SHA of the blob before the file is parsed
+    :param hunk_state: State of split_comments_and_code_incremental for the file; if provided, only the lines that
+                       changed since the previous version are parsed again
+    :param save_text: Whether to save the comments and code of the version; --references leaves the text in the
+                      object database
     """
 
+    save_path = f"v{version_count}_{commit_sha}_{filename.replace('/', '_')}"
+
+    if blob_reader is not None:
+        # a blob whose SHA is known up front is not even read on a hit
+        extracted = extraction_cache.get(blob_sha) if extraction_cache is not None and blob_sha is not None else None
+        if extracted is None:
+            if blob_sha is not None:
+                sha, data = blob_reader.read(blob_sha)
+            else:
+                sha, data = blob_reader.read_file(commit_sha, filename)
+            if data is None:
+                print(f"File not found at commit {commit_sha}")
+                return None
+            if extraction_cache is not None and blob_sha is None:
+                extracted = extraction_cache.get(sha)
+        if extracted is None:
+            try:
+                content = decode_blob(data)
+            except UnicodeDecodeError:
+                print(f"Could not decode file at commit {commit_sha}")
+                return None
+            extracted = split_content(content, hunk_state)
+            if extraction_cache is not None:
+                extraction_cache.put(sha, *extracted)
+        comments, code, function = extracted
+        if save_text:
+            save_comments_and_code(save_path, comments, code)
+            print(f"File saved at: {save_path}")
+        return function
+
     repo = Repo(repo_path)
     repo.git.reset('--hard', commit_sha)
 
     source_path = os.path.join(repo_path, filename)
-    save_path = f"v{version_count}_{commit_sha}_{filename.replace('/', '_')}"
+
+    sha = None
+    if extraction_cache is not None and os.path.exists(source_path):
+        with open(source_path, 'rb') as file:
+            sha = git_blob_sha(file.read())
+        extracted = extraction_cache.get(sha)
+        if extracted is not None:
+            comments, code, function = extracted
+            save_comments_and_code(save_path, comments, code)
+            print(f"File saved at: {save_path}")
+            repo.git.reset('--hard', 'HEAD')
+            return function
 
     try:
         with open(source_path, 'r') as file:
@@ -127,7 +741,9 @@ def download_file_at_commit(repo_path, commit_sha, filename, version_count):
             except UnicodeDecodeError:
                 with open('your_file.txt', 'r', encoding='utf-8') as file:
                     content = file.read()
-            comments, code, function = split_comments_and_code(content)
+            comments, code, function = split_content(content, hunk_state)
+            if sha is not None:
+                extraction_cache.put(sha, comments, code, function)
             # # add a layer of "docstring" to the function dictionary between the key and value
             # function = {k: {"docstring": v} for k, v in function.items()}
             save_comments_and_code(save_path, comments, code)
@@ -144,13 +760,15 @@ def download_file_at_commit(repo_path, commit_sha, filename, version_count):
 
 
 
-def split_comments_and_code(content):
+def split_comments_and_code(content, parse_state=None):
     """
     Split the comments and code from the content on a function level
 
     Docstrings and its line numbers are extracted; code and its line numbers are extracted
 
     :param content: Content of the file
+    :param parse_state: Dictionary in which, if provided, the parser records the lines where it started a new function
+                        (reset_lines) and whether the content ended inside a docstring (in_docstring)
     """
     comments_with_line = []  # List to store comments along with line numbers
     code = []  # List to store code lines
@@ -225,6 +843,8 @@ def split_comments_and_code(content):
             if function_match is None:
                 function_match = re.match(r'\s*class\s+([a-zA-Z_][a-zA-Z0-9_]*)\s*\(.*\)\s*:', line)
             if function_match:
+                if parse_state is not None:
+                    parse_state.setdefault('reset_lines', []).append(current_line_number)
                 # If there was a previous function, store its code
                 if current_function:
                     if len('\n'.join(docstring_lines)) == 0:
@@ -269,10 +889,104 @@ def split_comments_and_code(content):
                 'code_lines': {'start_line': start_code_line, 'end_line': current_line_number - 1}
             }
 
+    if parse_state is not None:
+        parse_state['in_docstring'] = in_docstring
+
     return comments_with_line, '\n'.join(code), functions
 
 
 
+def split_content(content, hunk_state=None):
+    """
+    Split the comments and code from the content, incrementally if a hunk_state is provided
+
+    :param content: Content of the file
+    :param hunk_state: State of split_comments_and_code_incremental for the file
+    """
+    if hunk_state is None:
+        return split_comments_and_code(content)
+    return split_comments_and_code_incremental(content, hunk_state)
+
+def split_comments_and_code_incremental(content, hunk_state):
+    """
+    Split the comments and code from the content exactly like split_comments_and_code, re-parsing only the lines
+    that changed since the previous content split with the same hunk_state
+
+    The parser starts afresh at every def or class line outside a docstring, so the file is kept as chunks starting
+    at such lines, each split on its own. The chunks before the first changed line are reused as they are; the
+    changed lines are split up to the start of a chunk past the last changed line, and if that split does not end
+    inside a docstring the chunks from there on are reused with their line numbers shifted
+
+    :param content: Content of the file
+    :param hunk_state: Dictionary holding the lines and chunks of the previous content; empty for the first version
+    """
+    lines = content.split('\n')
+    old_lines = hunk_state.get('lines')
+
+    if old_lines is None:
+        chunks = split_chunks(lines, 0, len(lines))
+    elif lines == old_lines:
+        chunks = hunk_state['chunks']
+    else:
+        old_chunks = hunk_state['chunks']
+        limit = min(len(lines), len(old_lines))
+        prefix = 0
+        while prefix < limit and lines[prefix] == old_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and lines[-1 - suffix] == old_lines[-1 - suffix]:
+            suffix += 1
+        shift = len(lines) - len(old_lines)
+
+        # a chunk ending before the first changed line is split the same, as is the def line ending it
+        kept = [chunk for chunk in old_chunks if chunk[1] < prefix]
+        start = kept[-1][1] if kept else 0
+        # every chunk but the first starts at a def line, where the split can resume
+        tail = [index for index, chunk in enumerate(old_chunks)
+                if index > 0 and chunk[0] >= len(old_lines) - suffix and chunk[0] + shift > start]
+
+        chunks = None
+        for index in tail[:RESYNC_ATTEMPTS]:
+            end = old_chunks[index][0] + shift
+            parse_state = {}
+            extracted = split_comments_and_code('\n'.join(lines[start:end]), parse_state)
+            if not parse_state['in_docstring']:
+                moved = [(chunk_start + shift, chunk_end + shift, *chunk_extracted)
+                         for chunk_start, chunk_end, *chunk_extracted in old_chunks[index:]]
+                chunks = kept + [(start, end, *extracted)] + moved
+                break
+        if chunks is None:
+            chunks = kept + split_chunks(lines, start, len(lines))
+
+    hunk_state['lines'] = lines
+    hunk_state['chunks'] = chunks
+
+    comments = []
+    functions = {}
+    for chunk_start, _, chunk_comments, _, chunk_functions in chunks:
+        comments.extend((line_number + chunk_start, comment) for line_number, comment in chunk_comments)
+        for function_name, record in chunk_functions.items():
+            functions[function_name] = {key: {position: line_number + chunk_start for position, line_number in value.items()}
+                                        if key.endswith('_lines') else value for key, value in record.items()}
+    return comments, chunks[-1][3], functions
+
+def split_chunks(lines, start, end):
+    """
+    Split lines[start:end] into chunks starting at the lines where the parser starts a new function, and split the
+    comments and code of every chunk on its own
+
+    Returns a list of (start, end, comments, code, functions), the line numbers of a chunk counting from its start
+
+    :param lines: Lines of the file
+    :param start: Index of the first line; the parser must start afresh there
+    :param end: Index past the last line
+    """
+    parse_state = {}
+    split_comments_and_code('\n'.join(lines[start:end]), parse_state)
+    boundaries = [start] + [start + line_number - 1 for line_number in parse_state.get('reset_lines', []) if line_number > 1] + [end]
+    return [(chunk_start, chunk_end, *split_comments_and_code('\n'.join(lines[chunk_start:chunk_end])))
+            for chunk_start, chunk_end in zip(boundaries, boundaries[1:])]
+
 def save_comments_and_code(save_path, comments_with_line, code):
     """
     This function saves the comments and code to a text file
@@ -288,123 +1002,152 @@ def save_comments_and_code(save_path, comments_with_line, code):
     with open(f"{save_path}_code.txt", 'w') as code_file:
         code_file.write(code)
 
-def what_changed_between_versions(json_file):
+def what_changed_between_versions(json_file, start_version=1):
     """
     This function compares the functions between consecutive versions and prints the differences in code, docstring and both
     It also saves the differences in a text file, with the naming convention: code_diff_<filename>.txt, docstring_diff_<filename>.txt, differ_<filename>.txt
 
     :param json_file: Name of the JSON file containing the functions
+    :param start_version: First version to compare with the next one; earlier versions were compared by a previous run
     """
     # go consecutive versions and compare the functions to see if code or docstring or both changed
     with open(json_file, 'r') as function_file:
         functions = json.load(function_file)
 
-    version_count = len(functions)
-    version = 1
+    # the versions mined by the runs before start_version may be missing once their `_files` folder was deleted
+    version_count = max((int(key[1:]) for key in functions), default=0)
+    version = start_version
+
+    while version < version_count:
+        compare_versions(functions[f"v{version}"], functions[f"v{version + 1}"], version, json_file)
+        version += 1
+
+def compare_versions(current_version, next_version, version, json_file):
+    """
+    This function compares the functions of two consecutive versions and prints the differences in code, docstring and both
+    The differences are appended to the text files of the file, see what_changed_between_versions
+
+    Returns the names of the functions whose docstring or code changed
+
+    :param current_version: Functions of the version
+    :param next_version: Functions of the next version
+    :param version: Number of the version; the next version is version + 1
+    :param json_file: Name of the JSON file of the functions, which the text files are named after
+    """
+    changed = set()
+    if current_version is None or next_version is None:
+        return changed
+
+    if current_version == {} or next_version == {}:
+        return changed
 
     code_differ_file = f"code_diff_{json_file.replace('.json', '.txt')}"
     docstring_differ_file = f"docstring_diff_{json_file.replace('.json', '.txt')}"
     differ_file = f"differ_{json_file.replace('.json', '.txt')}"
 
-    while version < version_count:
-        current_version = functions[f"v{version}"]
-        next_version = functions[f"v{version + 1}"]
-
-        if current_version is None or next_version is None:
-            version += 1
+    for function_name in current_version:
+        print(f"Function: {function_name}")
+        if function_name == 'commit_date_time' or function_name == 'commit_sha' or function_name == 'project' or function_name == 'owner' or function_name == 'filename' or function_name == 'file_path' or function_name == 'code_lines' or function_name == 'docstring_lines' or function_name == 'commit_message':
             continue
+        if function_name in next_version:
+            current_function = current_version[function_name]
+            next_function = next_version[function_name]
+            if current_function['docstring'] != next_function['docstring'] or current_function['code'] != next_function['code']:
+                changed.add(function_name)
+
+            # if not 'commit_date_time' in current_function or not 'commit_date_time' in next_function:
+
+            if current_function['docstring'] != next_function['docstring'] and current_function['code'] != next_function['code']:
+                print(f"Docstring and code changed for function {function_name} between versions {version} and {version + 1}")
+                with open(differ_file, 'a') as diff_file:
+                    diff_file.write(f"Docstring and code changed for function {function_name} between versions {version} and {version + 1}\n")
+                with open(f"{function_name}_v{version}_docstring.txt", 'w') as docstring_file:
+                    docstring_file.write(current_function['docstring'])
+                with open(f"{function_name}_v{version + 1}_docstring.txt", 'w') as docstring_file:
+                    docstring_file.write(next_function['docstring'])
+                with open(f"{function_name}_v{version}_code.txt", 'w') as code_file:
+                    code_file.write(current_function['code'])
+                with open(f"{function_name}_v{version + 1}_code.txt", 'w') as code_file:
+                    code_file.write(next_function['code'])
+                # print the exact changes between the two versions like git diff
+                # print(f"Diff for function {function_name} between versions {version} and {version + 1}")
+                os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt")
+                with open(differ_file, 'a') as diff_file:
+                    os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt >> {differ_file}")
+                    diff_file.write("\n")
+                os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt")
+                with open(differ_file, 'a') as diff_file:
+                    os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt >> {differ_file}")
+                    diff_file.write("\n")
+                # remove the temporary code files
+                os.remove(f"{function_name}_v{version}_docstring.txt")
+                os.remove(f"{function_name}_v{version + 1}_docstring.txt")
+                os.remove(f"{function_name}_v{version}_code.txt")
+                os.remove(f"{function_name}_v{version + 1}_code.txt")
+
+            if current_function['docstring'] != next_function['docstring']:
+                print(f"Docstring changed for function {function_name} between versions {version} and {version + 1}")
+                with open(docstring_differ_file, 'a') as diff_file:
+                    diff_file.write(f"Docstring changed for function {function_name} between versions {version} and {version + 1}\n")
+                with open(f"{function_name}_v{version}_docstring.txt", 'w') as docstring_file:
+                    docstring_file.write(current_function['docstring'])
+                with open(f"{function_name}_v{version + 1}_docstring.txt", 'w') as docstring_file:
+                    docstring_file.write(next_function['docstring'])
+                # print the exact changes between the two versions like git diff
+                # print(f"Diff for function {function_name} between versions {version} and {version + 1}")
+                os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt")
+                with open(docstring_differ_file, 'a') as diff_file:
+                    os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt >> {docstring_differ_file} ")
+                    diff_file.write("\n")
+                # remove the temporary code files
+                os.remove(f"{function_name}_v{version}_docstring.txt")
+                os.remove(f"{function_name}_v{version + 1}_docstring.txt")
+
+            if current_function['code'] != next_function['code']:
+                print(f"Code changed for function {function_name} between versions {version} and {version + 1}")
+                with open(code_differ_file, 'a') as diff_file:
+                    diff_file.write(f"Code changed for function {function_name} between versions {version} and {version + 1}\n")
+                with open(f"{function_name}_v{version}_code.txt", 'w') as code_file:
+                    code_file.write(current_function['code'])
+                with open(f"{function_name}_v{version + 1}_code.txt", 'w') as code_file:
+                    code_file.write(next_function['code'])
+                # print the exact changes between the two versions like git diff
+                # print(f"Diff for function {function_name} between versions {version} and {version + 1}")
+                os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt")
+                with open(code_differ_file, 'a') as diff_file:
+                    os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt >> {code_differ_file}")
+                    diff_file.write("\n")
+                # remove the temporary code files
+                os.remove(f"{function_name}_v{version}_code.txt")
+                os.remove(f"{function_name}_v{version + 1}_code.txt")
+
+    return changed
+
+def get_files_folder(username, repository, filename):
+    """
+    This function returns the name of the directory the diff and JSON files of a file are moved to
 
-        if current_version == {} or next_version == {}:
-            version += 1
-            continue
-
-        for function_name in current_version:
-            print(f"Function: {function_name}")
-            if function_name == 'commit_date_time' or function_name == 'commit_sha' or function_name == 'project' or function_name == 'owner' or function_name == 'filename' or function_name == 'file_path' or function_name == 'code_lines' or function_name == 'docstring_lines' or function_name == 'commit_message':
-                continue
-            if function_name in next_version:
-                current_function = current_version[function_name]
-                next_function = next_version[function_name]
-
-                # if not 'commit_date_time' in current_function or not 'commit_date_time' in next_function:
-
-                if current_function['docstring'] != next_function['docstring'] and current_function['code'] != next_function['code']:
-                    print(f"Docstring and code changed for function {function_name} between versions {version} and {version + 1}")
-                    with open(differ_file, 'a') as diff_file:
-                        diff_file.write(f"Docstring and code changed for function {function_name} between versions {version} and {version + 1}\n")
-                    with open(f"{function_name}_v{version}_docstring.txt", 'w') as docstring_file:
-                        docstring_file.write(current_function['docstring'])
-                    with open(f"{function_name}_v{version + 1}_docstring.txt", 'w') as docstring_file:
-                        docstring_file.write(next_function['docstring'])
-                    with open(f"{function_name}_v{version}_code.txt", 'w') as code_file:
-                        code_file.write(current_function['code'])
-                    with open(f"{function_name}_v{version + 1}_code.txt", 'w') as code_file:
-                        code_file.write(next_function['code'])
-                    # print the exact changes between the two versions like git diff
-                    # print(f"Diff for function {function_name} between versions {version} and {version + 1}")
-                    os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt")
-                    with open(differ_file, 'a') as diff_file:
-                        os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt >> {differ_file}")
-                        diff_file.write("\n")
-                    os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt")
-                    with open(differ_file, 'a') as diff_file:
-                        os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt >> {differ_file}")
-                        diff_file.write("\n")
-                    # remove the temporary code files
-                    os.remove(f"{function_name}_v{version}_docstring.txt")
-                    os.remove(f"{function_name}_v{version + 1}_docstring.txt")
-                    os.remove(f"{function_name}_v{version}_code.txt")
-                    os.remove(f"{function_name}_v{version + 1}_code.txt")
-
-                if current_function['docstring'] != next_function['docstring']:
-                    print(f"Docstring changed for function {function_name} between versions {version} and {version + 1}")
-                    with open(docstring_differ_file, 'a') as diff_file:
-                        diff_file.write(f"Docstring changed for function {function_name} between versions {version} and {version + 1}\n")
-                    with open(f"{function_name}_v{version}_docstring.txt", 'w') as docstring_file:
-                        docstring_file.write(current_function['docstring'])
-                    with open(f"{function_name}_v{version + 1}_docstring.txt", 'w') as docstring_file:
-                        docstring_file.write(next_function['docstring'])
-                    # print the exact changes between the two versions like git diff
-                    # print(f"Diff for function {function_name} between versions {version} and {version + 1}")
-                    os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt")
-                    with open(docstring_differ_file, 'a') as diff_file:
-                        os.system(f"diff -u {function_name}_v{version}_docstring.txt {function_name}_v{version + 1}_docstring.txt >> {docstring_differ_file} ")
-                        diff_file.write("\n")
-                    # remove the temporary code files
-                    os.remove(f"{function_name}_v{version}_docstring.txt")
-                    os.remove(f"{function_name}_v{version + 1}_docstring.txt")
-
-                if current_function['code'] != next_function['code']:
-                    print(f"Code changed for function {function_name} between versions {version} and {version + 1}")
-                    with open(code_differ_file, 'a') as diff_file:
-                        diff_file.write(f"Code changed for function {function_name} between versions {version} and {version + 1}\n")
-                    with open(f"{function_name}_v{version}_code.txt", 'w') as code_file:
-                        code_file.write(current_function['code'])
-                    with open(f"{function_name}_v{version + 1}_code.txt", 'w') as code_file:
-                        code_file.write(next_function['code'])
-                    # print the exact changes between the two versions like git diff
-                    # print(f"Diff for function {function_name} between versions {version} and {version + 1}")
-                    os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt")
-                    with open(code_differ_file, 'a') as diff_file:
-                        os.system(f"diff -u {function_name}_v{version}_code.txt {function_name}_v{version + 1}_code.txt >> {code_differ_file}")
-                        diff_file.write("\n")
-                    # remove the temporary code files
-                    os.remove(f"{function_name}_v{version}_code.txt")
-                    os.remove(f"{function_name}_v{version + 1}_code.txt")
-
-        version += 1
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    """
+    return f'{username}_{repository}_{filename.replace("/", "_")}_files'
 
-def clean_up(repo_path, filename, last_commit):
+def clean_up(repo_path, filename, last_commit, folder=None):
     """
     This function cleans up the repository and moves the diff and JSON files to a unique directory named after the file and its project path
     It also deletes the cloned repository
 
     :param repo_path: Path to the cloned repository
     :param filename: Name of the file
+    :param last_commit: Commit to reset the repository to; nothing is reset if it is None
+    :param folder: Directory to move the files to; defaults to <repo_path>_<filename>_files
     """
     filename = filename.replace('/', '_')
     # move all files to a directory
-    if not os.path.exists('f{repo_path}_{filename}_files'):
+    if folder is not None:
+        os.makedirs(folder)
+    elif not os.path.exists('f{repo_path}_{filename}_files'):
         try:
             folder = f'{repo_path}_{filename}_files'
         except:
@@ -418,8 +1161,9 @@ def clean_up(repo_path, filename, last_commit):
             shutil.move(file, folder)
 
     # reset the repo to the last commit
-    repo = Repo(repo_path)
-    repo.git.reset('--hard', last_commit)
+    if last_commit is not None:
+        repo = Repo(repo_path)
+        repo.git.reset('--hard', last_commit)
 
 def copy_files(matching_files):
     """
@@ -453,22 +1197,162 @@ def help():
     print("This will process all the Python files from the linux repository owned by torvalds")
     print("Example: python parse.py")
     print("This will process all the Python files in all the projects in the projects.csv file")
+    print("Options:")
+    print("  --no-checkout  Read every version of a file straight from the object database instead of checking it out")
+    print("  --single-pass  Walk the history of the repository once instead of once per file (copies are not followed, so versions can differ from a per-file traversal)")
+    print("  --workers N    Mine the files of a project with N worker processes (implies --no-checkout)")
+    print("  --projects N   Mine N projects of projects.csv at the same time, sharing the --workers pool")
+    print("  --clones N     With --projects, clone at most N projects at the same time (defaults to --projects)")
+    print("  --disk-limit G With --projects or --prefetch, start no new clone while the clones use more than G gigabytes")
+    print("  --partial-clone Clone without blobs (--filter=blob:none) and fetch the blobs of the python files in batches (implies --no-checkout)")
+    print("  --mirror-cache DIR Keep bare mirrors of the projects in DIR between runs and only fetch what is new")
+    print("  --incremental  Only mine the commits that are new since the last --incremental run, and append to its output")
+    print(f"  --state-dir DIR With --incremental, keep the state of every file in DIR (default: {INCREMENTAL_STATE_DIR})")
+    print("  --extraction-cache DIR Keep what is extracted from every blob in DIR, keyed by the blob SHA, and never parse a blob twice")
+    print("  --extraction-cache-size G Evict the least recently used entries once the extraction cache is above G gigabytes (default: 1)")
+    print("  --streaming    Compare every version with the previous one as soon as it is extracted, keeping only those two in memory")
+    print("  --full-history-json With --streaming, still write every version to the functions JSON file")
+    print("  --references   Keep every version as the blob SHA, line ranges and content hashes of its functions, and read the text of a function back only for its pairs (implies --streaming and --no-checkout)")
+    print("  --pickaxe      Skip the files whose history never had a triple quote and a def or class, found with git log -G")
+    print("  --version-workers N Extract the versions of a file with a long history in N processes, by commit range (needs --no-checkout)")
+    print("  --version-chunk K With --version-workers, split the history of a file into ranges of at least K versions (default: 200)")
+    print("  --backend B    With --version-workers, extract in threads or processes; auto (default) uses threads only when the interpreter runs without the GIL")
+    print("  --include GLOB Only mine the python files matching GLOB; may be given several times")
+    print("  --exclude GLOB Do not mine the python files matching GLOB; may be given several times")
+    print("  --filter-paths Do not mine vendored, copied and generated files (site-packages, vendor, migrations, _pb2.py, ...)")
+    print("  --max-file-size K Do not mine the python files above K kilobytes at HEAD")
+    print("  --skip-single-commit Skip the files touched by a single commit, which cannot have a version pair")
+    print("  --journal PATH Journal of the finished projects and files, used to resume an interrupted run (default: mining_journal.jsonl)")
+    print("  --retries N    Retry a failed file or project N times (default: 1), waiting --backoff S seconds (default: 1) before the first retry and twice as long before every next one, up to a minute")
+    print("  --file-timeout S Give up on a file after S seconds")
+    print("  --project-timeout S Give up on a project after S seconds")
+    print("  --memory-limit G Give up on a file, or on the clone of a project, once its process uses more than G gigabytes")
+    print("  --max-pairs N / --max-commits N / --max-seconds S Stop mining a project once its files emitted N pairs, traversed N commits or took S seconds, mining the files with the most commits first")
+    print("  --quarantine PATH List of the files and projects given up on, which later runs skip (default: quarantine.jsonl)")
+    print("  --hunks        Only parse again the lines of a file that changed since its previous version")
+    print("  --lpt          With --workers, mine the files with the most commits times bytes first, and write the estimates and runtimes to cost_model_report.csv")
+    print("  --prefetch K   Mine the projects of projects.csv one at a time while the next K are cloned in the background")
+    print("  --plan         Only plan the mining from the metadata of the projects: write their predicted pairs, runtime and disk to plan.csv")
+    print("  --refresh DATASET Mine again only the functions of DATASET (e.g. an existing codocbench.jsonl), following them with git log -L; give the --single-pass setting DATASET was mined with, to keep its version numbers")
+    print("  --queue PATH   Lease the projects from a work queue shared by workers on several hosts (a SQLite database on a shared filesystem)")
+    print("  --worker-id ID With --queue, name of this worker (default: host name and process ID)")
+    print("  --lease S      With --queue, seconds a lease lasts unless renewed (default: 600)")
+    print("  --merge-shards With --queue, merge the codocbench.jsonl shards of all the workers into differ_files/codocbench.jsonl")
+    print("  --remote URL   Template of the URL to clone from (default: https://github.com/{username}/{repository}.git)")
     sys.exit(1)
 
+def parse_arguments(argv=None):
+    """
+    This function parses the command line arguments
+    The positional arguments are the username, the repository and the filename; all of them are optional
+
+    :param argv: List of arguments to parse; defaults to sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('username', nargs='?')
+    parser.add_argument('repository', nargs='?')
+    parser.add_argument('filename', nargs='?')
+    parser.add_argument('--no-checkout', action='store_true')
+    parser.add_argument('--single-pass', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--projects', type=int, default=1)
+    parser.add_argument('--clones', type=int, default=0)
+    parser.add_argument('--disk-limit', type=float, default=0)
+    parser.add_argument('--partial-clone', action='store_true')
+    parser.add_argument('--remote', default='https://github.com/{username}/{repository}.git')
+    parser.add_argument('--mirror-cache')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--state-dir', default=INCREMENTAL_STATE_DIR)
+    parser.add_argument('--extraction-cache')
+    parser.add_argument('--extraction-cache-size', type=float, default=1)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--pickaxe', action='store_true')
+    parser.add_argument('--journal', default='mining_journal.jsonl')
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--backoff', type=float, default=1)
+    parser.add_argument('--file-timeout', type=float, default=0)
+    parser.add_argument('--project-timeout', type=float, default=0)
+    parser.add_argument('--memory-limit', type=float, default=0)
+    parser.add_argument('--quarantine', default='quarantine.jsonl')
+    parser.add_argument('--hunks', action='store_true')
+    parser.add_argument('--lpt', action='store_true')
+    parser.add_argument('--prefetch', type=int, default=0)
+    parser.add_argument('--skip-single-commit', action='store_true')
+    parser.add_argument('--version-workers', type=int, default=1)
+    parser.add_argument('--version-chunk', type=int, default=200)
+    parser.add_argument('--backend', choices=['auto', 'threads', 'processes'], default='auto')
+    parser.add_argument('--include', action='append', default=[])
+    parser.add_argument('--exclude', action='append', default=[])
+    parser.add_argument('--filter-paths', action='store_true')
+    parser.add_argument('--max-file-size', type=float, default=0)
+    parser.add_argument('--max-pairs', type=int, default=0)
+    parser.add_argument('--max-commits', type=int, default=0)
+    parser.add_argument('--max-seconds', type=float, default=0)
+    parser.add_argument('--plan', action='store_true')
+    parser.add_argument('--refresh')
+    parser.add_argument('--queue')
+    parser.add_argument('--worker-id')
+    parser.add_argument('--lease', type=float, default=600)
+    parser.add_argument('--merge-shards', action='store_true')
+    parser.add_argument('--full-history-json', action='store_true')
+    parser.add_argument('--references', action='store_true')
+    parser.add_argument('-h', '--help', action='store_true')
+
+    options, unknown = parser.parse_known_args(argv)
+    if unknown or options.help or (options.username is not None and options.repository is None):
+        help()
+    if options.merge_shards and not options.queue:
+        help()
+    if options.worker_id is None:
+        options.worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    # the files are mined in scratch workspaces, so the state of --incremental needs a path that does not depend on them
+    options.state_dir = os.path.abspath(options.state_dir)
+    # and so do the extraction cache the workers and the --version-workers ranges open from their workspaces
+    if options.extraction_cache is not None:
+        options.extraction_cache = os.path.abspath(options.extraction_cache)
+
+    # the workers share one working tree, so they can only read the versions from the object database
+    if options.workers > 1 or options.projects > 1:
+        options.no_checkout = True
+    # --refresh reads the few versions it needs straight from the object database
+    if options.refresh:
+        options.no_checkout = True
+    # a partial clone has no working tree to check the versions out into
+    if options.partial_clone:
+        options.no_checkout = True
+    # the text of a reference is read back from the object database, by the SHA of its blob
+    if options.references:
+        options.streaming = True
+        options.no_checkout = True
+    return options
+
 def main():
     """
     This is the main function
     It processes the projects and creates the differ files
     """
-    if len(sys.argv) not in [1, 3, 4]:
-        help()
-
-    if len(sys.argv) == 1:
-        process_projects()
+    options = parse_arguments()
+
+    if options.merge_shards:
+        merge_queue_shards(options)
+        return
+
+    if options.plan:
+        plan_projects(options)
+        return
+
+    if options.refresh:
+        refresh_dataset(options)
+    elif options.queue:
+        process_queue(options)
+    elif options.username is None:
+        process_projects(options)
     else:
-        process_single_project()
+        process_single_project(options.username, options.repository, options.filename, options)
 
-    create_differ_files()
+    report_extraction_cache(options)
+
+    create_differ_files(append=options.incremental)
 
     # run whitespace only script on combined_diff_mapping_differ_.jsonl in the differ_files directory
     remove_all_whitespace('differ_files/combined_diff_mapping_differ_.jsonl')
@@ -495,61 +1379,1021 @@ def main():
 
     fix_docstring_code_lines('differ_files/codocbench.jsonl')
 
+    if options.queue:
+        publish_shard(options)
+
     # remove the temporary files
-    delete_repo_folders()
+    delete_repo_folders(options)
 
-def process_projects():
+    close_journal()
+
+def process_projects(options=None):
     """
     In case no arguments are provided, this function processes all the projects in the projects.csv file
     All the files from the projects are processed
+
+    :param options: Parsed command line options
     """
+    if options is None:
+        options = parse_arguments([])
+
     with open('projects.csv', 'r') as projects_file:
         projects = projects_file.readlines()[1:]
+        if options.projects > 1:
+            process_projects_concurrently([project.strip().split(',') for project in projects], options)
+            return
+        if options.prefetch > 0:
+            process_projects_with_prefetch([project.strip().split(',') for project in projects], options)
+            return
         for project in projects:
             username, repository = project.strip().split(',')
             print(f"Username: {username}")
             print(f"Repository: {repository}")
-            repo_path = clone_repository(username, repository)
-            all_PY_files = get_python_files(repo_path)
-            print("Total number of python files: ", len(all_PY_files))
-            for file in all_PY_files:
-                print(f"We are at file number {all_PY_files.index(file)}")
-                print(f"Number of files left: {len(all_PY_files) - all_PY_files.index(file)}")
-                process_file(username, repository, file, repo_path)
-            shutil.rmtree(repo_path, ignore_errors=True)
+            if not project_needs_processing(username, repository, options):
+                continue
+            get_journal(options).record(project_unit(username, repository), STARTED)
+            deadline = project_deadline(options)
+            try:
+                repo_path = clone_project(username, repository, options, deadline)
+                try:
+                    process_project_files(username, repository, repo_path, options, deadline=deadline)
+                finally:
+                    close_blob_readers()
+                    remove_clone(repo_path, options)
+            except LimitExceeded as e:
+                give_up_on_project(username, repository, e, options)
+                continue
+            get_journal(options).record(project_unit(username, repository), DONE)
+
+def process_projects_with_prefetch(projects, options):
+    """
+    This function mines the projects one after the other, like process_projects, while a background thread clones
+    or fetches the next --prefetch projects, so the mining never waits for a clone unless the clones are slower
+    The clones are made in order, one at a time, and no new clone is started while the clones on disk, the one being
+    mined included, use more than --disk-limit gigabytes
+
+    :param projects: List of (username, repository) pairs
+    :param options: Parsed command line options
+    """
+    disk_budget = DiskBudget(int(options.disk_limit * 1024 ** 3))
+    projects = iter(projects)
+    queue = deque()
 
-def process_single_project():
+    def prefetch_next():
+        for username, repository in projects:
+            if project_needs_processing(username, repository, options):
+                queue.append((username, repository, clone_executor.submit(prefetch_project, username, repository, options, disk_budget)))
+                return
+
+    with ThreadPoolExecutor(max_workers=1) as clone_executor:
+        try:
+            for _ in range(options.prefetch):
+                prefetch_next()
+            while queue:
+                username, repository, future = queue.popleft()
+                prefetch_next()
+                print(f"Username: {username}")
+                print(f"Repository: {repository}")
+                get_journal(options).record(project_unit(username, repository), STARTED)
+                try:
+                    repo_path, size, clone_seconds = future.result()
+                    # the clone counts against the deadline of the project, the time it waited in the queue does not
+                    deadline = project_deadline(options)
+                    if deadline is not None:
+                        deadline -= clone_seconds
+                    try:
+                        process_project_files(username, repository, repo_path, options, deadline=deadline)
+                    finally:
+                        close_blob_readers()
+                        remove_clone(repo_path, options)
+                        disk_budget.release(size)
+                except LimitExceeded as e:
+                    give_up_on_project(username, repository, e, options)
+                    continue
+                get_journal(options).record(project_unit(username, repository), DONE)
+        finally:
+            # when the run stops early, the clones that were prefetched but not mined are removed
+            for _, _, future in queue:
+                future.cancel()
+            for _, _, future in queue:
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                repo_path, size, _ = future.result()
+                remove_clone(repo_path, options)
+                disk_budget.release(size)
+
+def prefetch_project(username, repository, options, disk_budget):
+    """
+    This function clones a project ahead of its turn for process_projects_with_prefetch
+    Returns the path to the clone, its size in bytes and the seconds the clone took
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param options: Parsed command line options
+    :param disk_budget: DiskBudget limiting the total size of the clones
+    """
+    disk_budget.wait_for_room()
+    start = time.monotonic()
+    repo_path = clone_project(username, repository, options, project_deadline(options))
+    size = directory_size(repo_path)
+    disk_budget.add(size)
+    print(f"Prefetched {username}/{repository}")
+    return repo_path, size, time.monotonic() - start
+
+def plan_projects(options):
+    """
+    This function plans the mining of the projects of projects.csv, or of the project given on the command line,
+    without mining them (--plan)
+    Each project is cloned without blobs or checkout, and only the blobs of its python files at HEAD are fetched; the
+    plan of every project is written to plan.csv, most expensive first, and the metadata of every file to
+    plan_files.csv
+
+    :param options: Parsed command line options
+    """
+    if options.username is not None:
+        projects = [(options.username, options.repository)]
+    else:
+        with open('projects.csv', 'r') as projects_file:
+            projects = [project.strip().split(',') for project in projects_file.readlines()[1:]]
+
+    # only commits, trees and the blobs at HEAD are needed
+    clone_options = argparse.Namespace(**vars(options))
+    clone_options.partial_clone = True
+    clone_options.no_checkout = True
+    # a blobless clone made into the mirror cache would leave the mirrors blobless for the runs that mine them
+    clone_options.mirror_cache = None
+    rate = seconds_per_cost()
+
+    plans, file_rows = [], []
+    for username, repository in projects:
+        print(f"Planning {username}/{repository}")
+        repo_path = clone_repository(username, repository, clone_options)
+        try:
+            plan, rows = plan_project(username, repository, repo_path, rate)
+        finally:
+            close_blob_readers()
+            remove_clone(repo_path, clone_options)
+        plans.append(plan)
+        file_rows.extend(rows)
+
+    write_plan(plans)
+    write_plan_files(file_rows)
+    total_seconds = sum(plan['predicted_seconds'] for plan in plans)
+    print(f"Planned {len(plans)} projects: {round(sum(plan['estimated_pairs'] for plan in plans))} pairs expected, "
+          f"{round(total_seconds)} seconds of mining on one worker, "
+          f"{round(sum(plan['predicted_disk_bytes'] for plan in plans) / 1024 ** 3, 2)} gigabytes of disk; see plan.csv")
+    for plan in sorted(plans, key=lambda plan: plan['predicted_seconds'], reverse=True)[:10]:
+        share = plan['predicted_seconds'] / total_seconds * 100 if total_seconds else 0
+        print(f"  {plan['owner']}/{plan['repo']}: {round(plan['predicted_seconds'])} seconds ({round(share, 1)}%), "
+              f"{round(plan['estimated_pairs'])} pairs")
+
+def plan_project(username, repository, repo_path, rate):
+    """
+    This function plans the mining of one project from its metadata: the commits, the python files at HEAD with the
+    commits that touched each of them, and the functions of each file at HEAD that have a docstring
+    Returns the plan of the project and the rows of its files, see util.plan
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param repo_path: Path to the clone of the project, without blobs
+    :param rate: Seconds per byte of one version, see util.plan.seconds_per_cost
+    """
+    blobs = head_python_blobs(repo_path)
+    fetch_blobs(repo_path, blobs.values())
+    counts = commit_counts(repo_path)
+    blob_reader = get_blob_reader(repo_path)
+
+    rows = []
+    for filename, blob_sha in blobs.items():
+        _, data = blob_reader.read(blob_sha)
+        try:
+            functions = split_comments_and_code(decode_blob(data))[2] if data is not None else {}
+        except UnicodeDecodeError:
+            functions = {}
+        documented = sum(1 for function in functions.values() if function['docstring'])
+        size = len(data) if data is not None else 0
+        row = {'owner': username, 'repo': repository, 'file': filename, 'commits': counts.get(filename, 0),
+               'size_bytes': size, 'functions': len(functions), 'documented_functions': documented}
+        row.update(estimate_file(row['commits'], size, len(functions), documented, rate))
+        rows.append(row)
+
+    plan = {
+        'owner': username,
+        'repo': repository,
+        'commits': int(git_output(repo_path, 'rev-list', '--count', 'HEAD')),
+        'python_files': len(rows),
+        'documented_files': sum(1 for row in rows if row['documented_functions']),
+        'python_file_commits': sum(row['commits'] for row in rows),
+        'estimated_pairs': sum(row['estimated_pairs'] for row in rows),
+        'predicted_seconds': sum(row['predicted_seconds'] for row in rows),
+        # the clone holds the history and the checkout; every file adds its text files and functions JSON
+        'predicted_disk_bytes': object_store_size(repo_path) + sum(row['size_bytes'] for row in rows)
+                                + sum(row['predicted_output_bytes'] for row in rows),
+    }
+    return plan, rows
+
+def refresh_dataset(options):
+    """
+    This function mines again only the functions of an existing dataset (--refresh), to refresh or extend their
+    histories without mining whole projects
+    Only the versions in which git saw the lines of one of the functions change, and the versions right before them,
+    are extracted, and only the functions of the dataset are compared; the differ files and the functions JSON file of
+    every file are laid out like those of --streaming, so the rest of main builds codocbench.jsonl from them as usual
+
+    :param options: Parsed command line options
+    """
+    targets = load_refresh_targets(options.refresh)
+    for (username, repository), files in targets.items():
+        print(f"Username: {username}")
+        print(f"Repository: {repository}")
+        try:
+            repo_path = clone_project(username, repository, options, project_deadline(options))
+        except LimitExceeded as e:
+            give_up_on_project(username, repository, e, options)
+            continue
+        try:
+            # the versions are numbered along the same history as in the run that produced the dataset
+            histories = walk_history(repo_path) if options.single_pass else {}
+            for filename, functions in files.items():
+                refresh_file(username, repository, filename, repo_path, file_history(repo_path, filename, histories, options) or [],
+                             functions, options)
+        finally:
+            close_blob_readers()
+            remove_clone(repo_path, options)
+
+def load_refresh_targets(dataset):
+    """
+    This function reads the functions to refresh from a dataset in the format of codocbench.jsonl
+    Returns a dictionary from (owner, project) to a dictionary from file path to the names of the functions
+
+    :param dataset: Path to the dataset
+    """
+    targets = {}
+    with open(dataset, 'r') as dataset_file:
+        for line in dataset_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            files = targets.setdefault((record['owner'], record['project']), {})
+            files.setdefault(record['file_path'], set()).add(record['function'].split('.')[-1])
+    return targets
+
+def refresh_file(username, repository, filename, repo_path, history, functions, options):
+    """
+    This function gets the pairs of the given functions of a file, for refresh_dataset
+    The commits that changed the functions are found with `git log -L` on the lines the parser gives each function
+    in the file at HEAD; for a function that cannot be followed, every version of the file is compared
+    The versions keep the numbers they have in a full run with the same --single-pass setting. A function whose extent the parser saw differently in
+    older versions, e.g. past a stray triple quote, may miss the pairs of the lines it lost since
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    :param repo_path: Path to the cloned repository
+    :param history: Commits of the file, see file_history
+    :param functions: Names of the functions to refresh
+    :param options: Parsed command line options
+    """
+    blob_reader = get_blob_reader(repo_path)
+    _, data = blob_reader.read_file('HEAD', filename)
+    try:
+        content = decode_blob(data) if data is not None else None
+    except UnicodeDecodeError:
+        content = None
+
+    line_ranges = {function: function_line_range(content, function) if content is not None else None for function in functions}
+    unfollowed = [function for function, line_range in line_ranges.items() if line_range is None]
+    touched = line_range_commits(repo_path, filename, list(line_ranges.values())) if not unfollowed else None
+    if touched is None:
+        print(f"Could not follow function {', '.join(sorted(unfollowed)) or 'ranges'} of file {filename}, comparing every version")
+    versions = [version for version, commit in enumerate(history, 1)
+                if version > 1 and (touched is None or commit['commit_sha'] in touched)]
+    print(f"File: {filename}: {len(versions)} of {len(history)} versions changed the functions")
+
+    files_folder = get_files_folder(username, repository, filename)
+    if os.path.exists(files_folder):
+        shutil.rmtree(files_folder)
+
+    cwd = os.getcwd()
+    extraction_cache = get_extraction_cache(options)
+    workspace = TaskWorkspace()
+    os.chdir(workspace.path)
+    try:
+        refresh_versions(username, repository, filename, os.path.join(cwd, repo_path), history, functions, versions,
+                         blob_reader, extraction_cache)
+    except Exception:
+        workspace.discard()
+        raise
+    finally:
+        os.chdir(cwd)
+    workspace.publish(files_folder, cwd)
+
+def refresh_versions(username, repository, filename, repo_path, history, functions, versions, blob_reader, extraction_cache):
+    """
+    This function compares the given versions of a file with the versions right before them, for refresh_file
+    It writes the differ files and the functions JSON file in the working directory, and clean_up moves them into
+    the `_files` folder of the file
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    :param repo_path: Absolute path to the cloned repository
+    :param history: Commits of the file, see file_history
+    :param functions: Names of the functions to refresh
+    :param versions: Numbers of the versions to compare with the versions right before them
+    :param blob_reader: BlobReader of the repository
+    :param extraction_cache: ExtractionCache of the run, or None
+    """
+    files_folder = get_files_folder(username, repository, filename)
+    extracted = {}
+    for version in sorted({needed for version in versions for needed in (version - 1, version)}):
+        commit = history[version - 1]
+        function = download_file_at_commit(repo_path, commit['commit_sha'], filename, version, blob_reader,
+                                           commit.get('blob_sha'), extraction_cache)
+        if function is not None:
+            add_version_metadata(function, commit, username, repository, filename, repo_path)
+            function = {key: value for key, value in function.items() if key in VERSION_METADATA or key in functions}
+        extracted[version] = function
+
+    json_file = f"functions_{filename.replace('/', '_')}.json"
+    changed_versions = {}
+    for version in versions:
+        changed = compare_versions(extracted[version - 1], extracted[version], version - 1, json_file)
+        if changed:
+            keep_changed_functions(changed_versions, version - 1, extracted[version - 1], changed)
+            keep_changed_functions(changed_versions, version, extracted[version], changed)
+    with open(json_file, 'w') as function_file:
+        json.dump(changed_versions, function_file, indent=4)
+    clean_up(repo_path, filename, None, files_folder)
+
+def function_line_range(content, function):
+    """
+    This function returns the first and last line of a function in the content of a file, from its def or class line
+    to the end of its code as split_comments_and_code sees it
+    Returns None if the function is not defined exactly once, since its lines would then be ambiguous
+
+    :param content: Content of the file
+    :param function: Name of the function
+    """
+    lines = content.split('\n')
+    definitions = [number for number, line in enumerate(lines, 1)
+                   if re.match(rf'\s*(def|class)\s+{re.escape(function)}\s*\(', line)]
+    if len(definitions) != 1:
+        return None
+    entry = split_comments_and_code(content)[2].get(function)
+    if entry is None:
+        return None
+    end_line = max(entry['code_lines']['end_line'], entry['docstring_lines']['end_line'], definitions[0])
+    return definitions[0], min(end_line, len(lines))
+
+def process_queue(options):
+    """
+    This function mines the projects of the shared work queue given with --queue until there is none left to lease
+    The projects of projects.csv, if there is one in the current directory, are added to the queue first; the ones
+    already in it are left as they are, so every worker may be started with the same projects.csv
+    A project that fails, or whose worker dies, is given back to the queue and leased again, up to --retries times;
+    one that runs out of its limits is failed for good
+
+    :param options: Parsed command line options
+    """
+    queue = WorkQueue(options.queue, options.lease)
+    if os.path.exists('projects.csv'):
+        with open('projects.csv', 'r') as projects_file:
+            queue.add_projects([project.strip().split(',') for project in projects_file.readlines()[1:]])
+
+    while True:
+        project = queue.lease(options.worker_id, options.retries + 1)
+        if project is None:
+            break
+        username, repository = project
+        print(f"Username: {username}")
+        print(f"Repository: {repository}")
+        if not project_needs_processing(username, repository, options):
+            queue.complete(username, repository, options.worker_id)
+            continue
+        get_journal(options).record(project_unit(username, repository), STARTED)
+        deadline = project_deadline(options)
+        with LeaseRenewer(queue, username, repository, options.worker_id):
+            try:
+                repo_path = clone_project(username, repository, options, deadline)
+                try:
+                    process_project_files(username, repository, repo_path, options, deadline=deadline)
+                finally:
+                    close_blob_readers()
+                    remove_clone(repo_path, options)
+            except LimitExceeded as e:
+                give_up_on_project(username, repository, e, options)
+                queue.fail(username, repository, options.worker_id, str(e), 0)
+                continue
+            except Exception as e:
+                print(f"Error in project {username}/{repository}: {e}")
+                get_journal(options).record(project_unit(username, repository), FAILED, str(e))
+                queue.fail(username, repository, options.worker_id, str(e), options.retries + 1)
+                continue
+        get_journal(options).record(project_unit(username, repository), DONE)
+        queue.complete(username, repository, options.worker_id)
+
+    print(f"Queue {options.queue}: {queue.counts()}")
+
+def publish_shard(options):
+    """
+    This function copies the codocbench.jsonl of this worker to the shards directory next to the queue, where
+    --merge-shards picks it up; the copy is renamed into place, so a merge never reads half a shard
+
+    :param options: Parsed command line options
+    """
+    shard = shard_path(options.queue, options.worker_id)
+    os.makedirs(os.path.dirname(shard), exist_ok=True)
+    shutil.copyfile('differ_files/codocbench.jsonl', shard + '.tmp')
+    os.replace(shard + '.tmp', shard)
+    print(f"Published shard: {shard}")
+
+def merge_queue_shards(options):
+    """
+    This function merges the shards published by the workers of the queue into differ_files/codocbench.jsonl
+
+    :param options: Parsed command line options
+    """
+    counts = WorkQueue(options.queue, options.lease).counts()
+    unfinished = counts.get('pending', 0) + counts.get('leased', 0)
+    if unfinished:
+        print(f"Warning: {unfinished} projects of the queue are not mined yet")
+    os.makedirs('differ_files', exist_ok=True)
+    shards_dir = os.path.dirname(shard_path(options.queue, options.worker_id))
+    written, duplicates = merge_shards(shards_dir, 'differ_files/codocbench.jsonl')
+    print(f"Merged {written} records into differ_files/codocbench.jsonl, dropped {duplicates} duplicates")
+
+def clone_project(username, repository, options, deadline=None):
+    """
+    This function clones a project; with a project deadline, a clone that stalls past it is killed, and with
+    --memory-limit, the clone and its git processes get the same memory limit as every file of the project
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param options: Parsed command line options
+    :param deadline: Deadline of the project, see project_deadline
+    """
+    timeout = max(deadline - time.monotonic(), 0.001) if deadline is not None else 0
+    if not timeout and not options.memory_limit:
+        return clone_repository(username, repository, options)
+    return run_with_limits(clone_repository, (username, repository, options), timeout, int(options.memory_limit * 1024 ** 3))
+
+def give_up_on_project(username, repository, error, options):
+    """
+    This function records a project that ran out of its limits as failed, and puts it in quarantine
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param error: The LimitExceeded error
+    :param options: Parsed command line options
+    """
+    print(f"Giving up on project {username}/{repository}: {error}")
+    get_journal(options).record(project_unit(username, repository), FAILED, str(error))
+    get_quarantine(options).add(project_unit(username, repository), str(error))
+
+def project_needs_processing(username, repository, options):
+    """
+    This function checks whether a project of projects.csv still has to be mined, so that a resumed run does not
+    even clone the projects the journal records as done; an incremental run mines every project again, and so does
+    a run after the `_files` folders of the files of the project were deleted, see needs_processing
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param options: Parsed command line options
+    """
+    if project_unit(username, repository) in get_quarantine(options):
+        print(f"Project: {username}/{repository} is in quarantine, skipping it")
+        return False
+    if options.incremental or get_journal(options).state(project_unit(username, repository)) != DONE:
+        return True
+    prefix = file_unit(username, repository, '')
+    if not all(os.path.exists(get_files_folder(username, repository, unit[len(prefix):]))
+               for unit in get_journal(options).units(prefix, DONE)):
+        return True
+    print(f"Project: {username}/{repository} already processed")
+    return False
+
+def process_projects_concurrently(projects, options):
+    """
+    This function mines several projects at the same time
+    Each project is cloned, mined and deleted by its own thread; the files of all the projects share one pool of
+    worker processes, so the number of CPU workers stays bounded whatever the number of projects in flight
+    The number of concurrent clones and the total disk used by the clones are limited as well
+
+    :param projects: List of (username, repository) pairs
+    :param options: Parsed command line options
+    """
+    clone_slots = threading.Semaphore(options.clones or options.projects)
+    disk_budget = DiskBudget(int(options.disk_limit * 1024 ** 3))
+
+    with ProcessPoolExecutor(max_workers=options.workers, initializer=reset_worker_state) as executor:
+        with ThreadPoolExecutor(max_workers=options.projects) as project_executor:
+            futures = {
+                project_executor.submit(mine_project, username, repository, options, executor, clone_slots, disk_budget): (username, repository)
+                for username, repository in projects
+                if project_needs_processing(username, repository, options)
+            }
+            for future in as_completed(futures):
+                username, repository = futures[future]
+                try:
+                    future.result()
+                    print(f"Project done: {username}/{repository}")
+                except LimitExceeded as e:
+                    give_up_on_project(username, repository, e, options)
+                except Exception as e:
+                    print(f"Error in project {username}/{repository}: {e}")
+                    get_journal(options).record(project_unit(username, repository), FAILED, str(e))
+
+def mine_project(username, repository, options, executor, clone_slots, disk_budget):
+    """
+    This function clones, mines and deletes one project for process_projects_concurrently
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param options: Parsed command line options
+    :param executor: Process pool shared by all the projects
+    :param clone_slots: Semaphore limiting the number of concurrent clones
+    :param disk_budget: DiskBudget limiting the total size of the clones
+    """
+    print(f"Username: {username}")
+    print(f"Repository: {repository}")
+    get_journal(options).record(project_unit(username, repository), STARTED)
+    deadline = project_deadline(options)
+    disk_budget.wait_for_room()
+    with clone_slots:
+        repo_path = clone_project(username, repository, options, deadline)
+    size = directory_size(repo_path)
+    disk_budget.add(size)
+    try:
+        process_project_files(username, repository, repo_path, options, executor, deadline)
+        get_journal(options).record(project_unit(username, repository), DONE)
+    finally:
+        remove_clone(repo_path, options)
+        disk_budget.release(size)
+
+def process_single_project(username, repository, filename=None, options=None):
     """
     In case the arguments are provided, this function processes the single project
     If the filename is provided, only that file is processed
     Otherwise, all the files from the project are processed
-    """
-    username = sys.argv[1]
-    repository = sys.argv[2]
-    filename = sys.argv[3] if len(sys.argv) == 4 else None
 
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    :param options: Parsed command line options
+    """
     print(f"Username: {username}")
     print(f"Repository: {repository}")
     print(f"Filename: {filename}")
 
-    repo_path = clone_repository(username, repository)
+    deadline = project_deadline(options)
+    try:
+        repo_path = clone_project(username, repository, options, deadline)
+    except LimitExceeded as e:
+        give_up_on_project(username, repository, e, options)
+        return
 
     if filename is None:
+        try:
+            process_project_files(username, repository, repo_path, options, deadline=deadline)
+        except LimitExceeded as e:
+            give_up_on_project(username, repository, e, options)
+    else:
+        if options.partial_clone:
+            print(f"Fetched {fetch_python_blobs(repo_path, filename)} python blobs")
+        history = walk_history(repo_path).get(filename) if options.single_pass else None
+        get_commits(username, repository, filename, repo_path, options, history)
+        if options.partial_clone:
+            report_partial_clone(username, repository, repo_path)
+    close_blob_readers()
+    remove_clone(repo_path, options)
+
+def remove_clone(repo_path, options=None):
+    """
+    This function deletes the clone of a project once it is mined
+    The mirrors of the mirror cache are kept for the next run
+
+    :param repo_path: Path to the cloned repository
+    :param options: Parsed command line options
+    """
+    if options is not None and options.mirror_cache and in_mirror_cache(repo_path, options):
+        return
+    shutil.rmtree(repo_path, ignore_errors=True)
+
+def in_mirror_cache(path, options):
+    """
+    This function checks whether the path lies inside the mirror cache
+
+    :param path: Path to check
+    :param options: Parsed command line options
+    """
+    cache_dir = os.path.abspath(options.mirror_cache)
+    return os.path.commonpath([os.path.abspath(path), cache_dir]) == cache_dir
+
+def process_project_files(username, repository, repo_path, options=None, executor=None, deadline=None):
+    """
+    This function processes all the python files of a cloned project
+    Raises LimitExceeded once the deadline of the project has passed
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param repo_path: Path to the cloned repository
+    :param options: Parsed command line options
+    :param executor: Process pool to mine the files with; if not provided, one is created when --workers is above 1
+    :param deadline: Deadline of the project, see project_deadline
+    """
+    if options is None:
+        options = parse_arguments([])
+
+    if options.partial_clone or Repo(repo_path).bare:
+        # partial clones and mirrors have no working tree, the files are listed from the tree of HEAD instead
+        all_PY_files = get_python_files_from_tree(repo_path)
+    else:
         all_PY_files = get_python_files(repo_path)
-        print("Total number of python files: ", len(all_PY_files))
+    if options.partial_clone:
+        print(f"Fetched {fetch_python_blobs(repo_path)} python blobs")
+    print("Total number of python files: ", len(all_PY_files))
+    skipped = {}
+
+    if options.include or options.exclude or options.filter_paths or options.max_file_size:
+        # the rules only look at the paths and at the sizes of the blobs at HEAD, never at the history
+        filter_paths = FILTER_PATHS if options.filter_paths else ()
+        kept = [file for file in all_PY_files if path_allowed(file, options.include, options.exclude, filter_paths)]
+        if options.max_file_size:
+            sizes = blob_sizes(repo_path)
+            kept = [file for file in kept if sizes.get(file, 0) <= options.max_file_size * 1024]
+        skipped['by_filter'] = len(all_PY_files) - len(kept)
+        all_PY_files = kept
+        print(f"Skipped {skipped['by_filter']} python files by path or size, {len(all_PY_files)} left")
+
+    if options.pickaxe:
+        # let git search the history for the files that never had a docstring, instead of walking it for each of them
+        candidates = docstring_candidates(repo_path)
+        skipped['without_docstring'] = len([file for file in all_PY_files if file not in candidates])
+        all_PY_files = [file for file in all_PY_files if file in candidates]
+        print(f"Skipped {skipped['without_docstring']} python files that never had a docstring, {len(all_PY_files)} left")
+
+    # walk the history of the whole repository once instead of once per file
+    histories = walk_history(repo_path) if options.single_pass else {}
+
+    if options.skip_single_commit:
+        # a version pair needs two versions in which the file exists under its current name
+        if options.single_pass:
+            counts = {file: sum(1 for version in histories.get(file, []) if version['blob_sha'] is not None) for file in all_PY_files}
+        else:
+            counts = commit_counts(repo_path)
+        skipped['single_commit'] = len([file for file in all_PY_files if counts.get(file, 0) < 2])
+        all_PY_files = [file for file in all_PY_files if counts.get(file, 0) >= 2]
+        print(f"Skipped {skipped['single_commit']} python files with a single commit, {len(all_PY_files)} left")
+
+    if skipped:
+        report_skipped_files(username, repository, skipped, len(all_PY_files))
+
+    budget = project_budget(options)
+    if budget is not None:
+        # the files with the most versions have the most chances to yield pairs, so they are mined first
+        costs = file_costs(repo_path, all_PY_files, histories if options.single_pass else None)
+        all_PY_files.sort(key=lambda file: (-costs[file]['commits'], costs[file]['size_bytes']))
+
+    if executor is not None or options.workers > 1:
+        process_files_in_parallel(username, repository, repo_path, all_PY_files, histories, options, executor, deadline, budget)
+    else:
         for file in all_PY_files:
+            if budget is not None and budget.exhausted():
+                break
+            check_deadline(deadline, options)
             print(f"We are at file number {all_PY_files.index(file)}")
             print(f"Number of files left: {len(all_PY_files) - all_PY_files.index(file)}")
-            process_file(username, repository, file, repo_path)
+            process_file(username, repository, file, repo_path, options, histories.get(file), deadline)
+            if budget is not None:
+                budget.add(count_pairs(username, repository, file), costs[file]['commits'])
+
+    if budget is not None:
+        report_budget(username, repository, budget, len(all_PY_files))
+
+    if options.partial_clone:
+        report_partial_clone(username, repository, repo_path)
+
+def report_budget(username, repository, budget, total_files):
+    """
+    This function reports what a project used of its mining budget and which budget was hit, if any
+    The numbers are printed and appended to budget_report.csv
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param budget: MiningBudget of the project
+    :param total_files: Number of files the project had to mine
+    """
+    budget_hit = budget.exhausted() or ''
+    print(f"Budget of {username}/{repository}: {budget.pairs} pairs, {budget.commits} commits, "
+          f"{round(budget.seconds(), 1)} seconds, {budget.files}/{total_files} files mined"
+          + (f", stopped by the {budget_hit} budget" if budget_hit else ""))
+
+    append_report('budget_report.csv',
+                  ['owner', 'repo', 'budget_hit', 'pairs', 'commits', 'seconds', 'files_mined', 'total_files'],
+                  [[username, repository, budget_hit, budget.pairs, budget.commits, f"{budget.seconds():.1f}",
+                    budget.files, total_files]])
+
+def report_skipped_files(username, repository, skipped, files_left):
+    """
+    This function appends how many python files of the project were skipped before mining, and why, to
+    skipped_files_report.csv
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param skipped: Number of skipped files by reason: by_filter (--include, --exclude, --filter-paths,
+                    --max-file-size), without_docstring (--pickaxe), single_commit (--skip-single-commit)
+    :param files_left: Number of files left to mine
+    """
+    append_report('skipped_files_report.csv',
+                  ['owner', 'repo', 'skipped_by_filter', 'skipped_without_docstring', 'skipped_single_commit', 'files_left'],
+                  [[username, repository, skipped.get('by_filter'), skipped.get('without_docstring'),
+                    skipped.get('single_commit'), files_left]])
+
+def report_partial_clone(username, repository, repo_path):
+    """
+    This function reports how many bytes the partial clone of the project downloaded and saved
+    The numbers are printed and appended to partial_clone_report.csv
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param repo_path: Path to the cloned repository
+    """
+    stats = partial_clone_stats(repo_path)
+    print(f"Partial clone of {username}/{repository}: downloaded {stats['downloaded_bytes']} bytes, "
+          f"saved {stats['saved_bytes'] if stats['saved_bytes'] is not None else 'unknown'} bytes, "
+          f"{stats['missing_blobs']} blobs never fetched")
+
+    append_report('partial_clone_report.csv',
+                  ['owner', 'repo', 'downloaded_bytes', 'full_bytes', 'saved_bytes', 'missing_blobs'],
+                  [[username, repository, stats['downloaded_bytes'], stats['full_bytes'] or None, stats['saved_bytes'],
+                    stats['missing_blobs']]])
+
+def process_files_in_parallel(username, repository, repo_path, files, histories, options, executor=None, deadline=None, budget=None):
+    """
+    This function spreads the files of a project over a pool of worker processes
+    Each file is mined inside a private scratch directory, so the workers never see each other's intermediate files
+    The `_files` folders end up exactly where the serial run puts them, with the same content
+    Files that fail in a worker are retried through the pool, up to --retries times with an exponential backoff, so
+    nothing is ever mined in the shared working directory while other projects may be in flight; files that run out
+    of their limits are put in quarantine right away
+    Raises LimitExceeded once the deadline of the project has passed; the files not started by then are cancelled
+    With --lpt the most expensive files are dispatched first, so a large file is not left to run alone at the end,
+    and the estimated costs are written to cost_model_report.csv together with the runtimes of the files
+    Once the mining budget of the project is used up, the files not started yet are cancelled; the running ones are
+    let finish
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param repo_path: Path to the cloned repository
+    :param files: List of python files to process
+    :param histories: Version streams of the files from walk_history, if the history was walked in a single pass;
+                      otherwise the parent traverses the history of each file for its worker, see file_history
+    :param options: Parsed command line options
+    :param executor: Process pool to use; if not provided, a pool of --workers processes is created for the project
+    :param deadline: Deadline of the project, see project_deadline
+    :param budget: MiningBudget of the project, see project_budget; the files are expected in order of priority
+    """
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=options.workers, initializer=reset_worker_state) as executor:
+            return process_files_in_parallel(username, repository, repo_path, files, histories, options, executor, deadline, budget)
+
+    # the workers run in their scratch directories, so they need the absolute path of the clone
+    repo_path = os.path.abspath(repo_path)
+
+    pending = []
+    for file in files:
+        if needs_processing(username, repository, file, options):
+            pending.append(file)
+        else:
+            print(f"File: {file} already processed")
+
+    costs, runtimes = None, {}
+    if options.lpt or budget is not None:
+        costs = file_costs(repo_path, pending, histories if options.single_pass else None)
+    if options.lpt and budget is None:
+        pending.sort(key=lambda file: costs[file]['estimated_cost'], reverse=True)
+
+    for attempt in range(options.retries + 1):
+        if attempt:
+            delay = backoff_delay(attempt, options.backoff)
+            print(f"Retrying {len(pending)} failed files in {delay} seconds")
+            time.sleep(delay)
+        for file in pending:
+            get_journal(options).record(file_unit(username, repository, file), STARTED)
+        futures = {
+            executor.submit(mine_file_task, username, repository, file, repo_path, options,
+                            file_history(repo_path, file, histories, options), deadline): file
+            for file in pending
+        }
+        failed = []
+        try:
+            for done, future in enumerate(as_completed(futures, timeout=time_left(deadline)), 1):
+                file = futures[future]
+                if future.cancelled():
+                    continue
+                error, cache_counts, over_limit, runtime = future.result()
+                runtimes[file] = runtimes.get(file, 0) + runtime
+                if cache_counts is not None:
+                    get_extraction_cache(options).add_counts(cache_counts)
+                if error is not None:
+                    print(f"Error in file {file}: {error}")
+                    get_journal(options).record(file_unit(username, repository, file), FAILED, error)
+                    if over_limit or attempt == options.retries:
+                        print(f"Giving up on file: {file}")
+                        get_quarantine(options).add(file_unit(username, repository, file), error)
+                    else:
+                        failed.append(file)
+                else:
+                    get_journal(options).record(file_unit(username, repository, file), DONE)
+                if budget is not None and file not in failed:
+                    # a file counts once it is mined or given up on, not on every attempt
+                    budget.add(count_pairs(username, repository, file), costs[file]['commits'])
+                    if budget.exhausted():
+                        for pending_future in futures:
+                            pending_future.cancel()
+                print(f"Files done for {username}/{repository}: {done}/{len(pending)}")
+        except FuturesTimeoutError:
+            for future in futures:
+                future.cancel()
+            check_deadline(deadline, options)
+        if not failed or (budget is not None and budget.exhausted()):
+            break
+        pending = failed
+
+    if options.lpt:
+        report_file_costs(username, repository, costs, runtimes)
+
+def report_file_costs(username, repository, costs, runtimes):
+    """
+    This function appends the estimated cost and the actual runtime of every file of the project to
+    cost_model_report.csv, so the cost model used by --lpt can be checked against what the files really took
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param costs: Estimated costs of the files, see util.scheduler.file_costs
+    :param runtimes: Seconds the workers spent on each file, over all its attempts
+    """
+    append_report('cost_model_report.csv',
+                  ['owner', 'repo', 'file', 'commits', 'size_bytes', 'estimated_cost', 'runtime_seconds'],
+                  [[username, repository, file, cost['commits'], cost['size_bytes'], cost['estimated_cost'],
+                    f"{runtimes[file]:.3f}" if file in runtimes else None]
+                   for file, cost in costs.items()])
+
+def time_left(deadline):
+    """
+    This function returns the seconds left before the deadline of a project, None if there is no deadline
+
+    :param deadline: Deadline of the project, see project_deadline
+    """
+    return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+def reset_worker_state():
+    """
+    This function resets the per-process state a forked worker inherits from its parent
+    The blob readers of the parent share their pipes with the parent, so the worker must start its own,
+    and the counters of the extraction cache of the parent must not be counted twice
+    """
+    global extraction_cache, journal, quarantine
+    blob_readers.clear()
+    extraction_cache = None
+    journal = None
+    quarantine = None
+
+def mine_file_task(username, repository, file, repo_path, options, history, deadline=None):
+    """
+    This function is the task a worker process runs for a file
+    It gets the commits for the file inside a scratch directory, in a child process of the worker bounded by the
+    wall-clock and memory limits of the file if there are any, so a file running out of them costs only its own time
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param file: Name of the file
+    :param repo_path: Absolute path to the cloned repository
+    :param options: Parsed command line options
+    :param history: Commits of the file, see file_history
+    :param deadline: Deadline of the project, see project_deadline
+    :return: The error message and extraction cache counters of mine_file_in_scratch, whether the file ran out
+             of its limits, and the seconds the task took
+    """
+    start = time.monotonic()
+    timeout = file_time_limit(options, deadline)
+    if not timeout and not options.memory_limit:
+        try:
+            result = mine_file_in_scratch(username, repository, file, repo_path, options, history) + (False,)
+        except MemoryError:
+            result = 'ran out of memory', None, True
     else:
-        get_commits(username, repository, filename, repo_path)
-    shutil.rmtree(repo_path, ignore_errors=True)
+        # a child killed for its limits never gets to remove its workspace, so the worker owns it
+        workspace = TaskWorkspace()
+        try:
+            result = run_with_limits(mine_file_in_child, (username, repository, file, repo_path, options, history, workspace),
+                                     timeout, int(options.memory_limit * 1024 ** 3)) + (False,)
+        except LimitExceeded as e:
+            result = str(e), None, True
+        except RuntimeError as e:
+            result = str(e), None, False
+        finally:
+            workspace.discard()
+    return result + (time.monotonic() - start,)
+
+def mine_file_in_child(username, repository, file, repo_path, options, history, workspace):
+    """
+    This function runs mine_file_in_scratch in a child process forked by run_with_limits, after dropping the state
+    inherited from the parent
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param file: Name of the file
+    :param repo_path: Absolute path to the cloned repository
+    :param options: Parsed command line options
+    :param history: Version stream of the file from walk_history, if the history was walked in a single pass
+    :param workspace: TaskWorkspace of the file, which the parent removes even if the child is killed
+    """
+    reset_worker_state()
+    return mine_file_in_scratch(username, repository, file, repo_path, options, history, workspace)
+
+def mine_file_in_scratch(username, repository, file, repo_path, options, history, workspace=None):
+    """
+    This function gets the commits for the file inside a fresh scratch workspace, see util.workspace
+    The intermediate files of the file never leave the workspace, so clean_up only lists the files of this file; the
+    `_files` folder it leaves there is renamed into the working directory once the file is done, and the whole
+    workspace is removed if the file failed
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param file: Name of the file
+    :param repo_path: Absolute path to the cloned repository
+    :param options: Parsed command line options
+    :param history: Version stream of the file from walk_history, if the history was walked in a single pass
+    :param workspace: TaskWorkspace to mine the file in; a new one is created if not provided
+    :return: None if the file was processed, the error message otherwise, along with the counters of the
+             extraction cache for the file (None without --extraction-cache)
+    """
+    # a worker serves files of several projects over its lifetime; only the reader of this one is kept alive
+    close_blob_readers(keep=repo_path)
+
+    cwd = os.getcwd()
+    files_folder = get_files_folder(username, repository, file)
+    cache = get_extraction_cache(options)
+    counts_before = cache.counts() if cache is not None else None
+    if workspace is None:
+        workspace = TaskWorkspace()
+    try:
+        # an incremental run appends to the files of the previous runs, so they are brought into the workspace
+        if os.path.exists(files_folder):
+            workspace.adopt(files_folder)
+        os.chdir(workspace.path)
+        try:
+            get_commits(username, repository, file, repo_path, options, history)
+        finally:
+            os.chdir(cwd)
+    except MemoryError:
+        # a file running out of memory is not retried, see mine_file_task
+        workspace.discard()
+        raise
+    except Exception as e:
+        workspace.discard()
+        return str(e), cache_counts_since(cache, counts_before)
+    workspace.publish(files_folder, cwd)
+    return None, cache_counts_since(cache, counts_before)
+
+def cache_counts_since(cache, counts_before):
+    """
+    This function returns how much the counters of the extraction cache grew since counts_before
 
-def delete_repo_folders():
+    :param cache: ExtractionCache of the process, or None
+    :param counts_before: Counters of the cache taken earlier
+    """
+    if cache is None:
+        return None
+    return {key: value - counts_before[key] for key, value in cache.counts().items()}
+
+def kept_folders(options):
+    """
+    This function lists the folders of the run that outlive it: the mirror cache, the extraction cache, the state
+    directory of --incremental, and the scratch workspaces, which another worker of the queue may still be using
+
+    :param options: Parsed command line options
+    """
+    folders = [options.state_dir, WORKSPACES]
+    if options.mirror_cache:
+        folders.append(options.mirror_cache)
+    if options.extraction_cache is not None:
+        folders.append(options.extraction_cache)
+    return [os.path.abspath(folder) for folder in folders]
+
+def delete_repo_folders(options=None):
     """
     Deletes all folders in the current directory that start with '<username>_<repository>'.
+    The folders of kept_folders are kept, and so are the folders that hold one of them, even if they live in the
+    current directory.
     """
+    kept = kept_folders(options) if options is not None else [os.path.abspath(WORKSPACES)]
     for folder in os.listdir('.'):  # List all items in the current directory
+        path = os.path.abspath(folder)
+        if any(os.path.commonpath([path, kept_folder]) in (path, kept_folder) for kept_folder in kept):
+            continue
         if os.path.isdir(folder) and '_' in folder and 'differ' not in folder:  # Check if it is a folder and contains '_'
             parts = folder.split('_')
             if len(parts) >= 2:  # Ensure the name has at least two parts
@@ -571,44 +2415,123 @@ def get_python_files(repo_path):
                 all_PY_files.append(file)
     return [file for file in all_PY_files if file]
 
-def process_file(username, repository, file, repo_path):
+def get_python_files_from_tree(repo_path):
+    """
+    This function gets all the python files from the tree of HEAD, for clones without a working tree
+
+    :param repo_path: Path to the cloned repository
+    """
+    repo = Repo(repo_path)
+    return [file for file in repo.git.ls_tree('-r', '-z', '--name-only', 'HEAD').split('\0') if file.endswith('.py')]
+
+def process_file(username, repository, file, repo_path, options=None, history=None, deadline=None):
     """
     This function processes the file and gets the commits for the file
+    Every attempt is recorded in the journal; a failed file is retried on a fresh clone up to --retries times, with an
+    exponential backoff, and put in quarantine once it failed for good or ran out of its limits
 
     :param username: Username of the repository owner
     :param repository: Name of the repository
     :param file: Name of the file
     :param repo_path: Path to the cloned repository
+    :param options: Parsed command line options
+    :param history: Version stream of the file from walk_history, if the history was walked in a single pass
+    :param deadline: Deadline of the project, see project_deadline
     """
+    if options is None:
+        options = parse_arguments([])
+
     print(f"Getting commits for file: {file}")
-    files_folder = f'{username}_{repository}_{file.replace("/", "_")}_files'
-    if not os.path.exists(files_folder):
+    if not needs_processing(username, repository, file, options):
+        print(f"File: {file} already processed")
+        return
+
+    unit = file_unit(username, repository, file)
+    for attempt in range(options.retries + 1):
+        get_journal(options).record(unit, STARTED)
         try:
-            get_commits(username, repository, file, repo_path)
+            mine_file(username, repository, file, repo_path, options, history, deadline)
         except Exception as e:
             print(f"Error: {e}")
-            print(f"Retrying to process file: {file}")
-            shutil.rmtree(repo_path, ignore_errors=True)
-            while True:
-                get_commits(username, repository, file, repo_path)
-                if os.path.exists(files_folder):
-                    break
-    else:
-        print(f"File: {file} already processed")
+            get_journal(options).record(unit, FAILED, str(e))
+            if not isinstance(e, LimitExceeded) and attempt < options.retries:
+                delay = backoff_delay(attempt + 1, options.backoff)
+                print(f"Retrying to process file: {file} in {delay} seconds")
+                time.sleep(delay)
+                # the reader of the clone would keep reading the object database of the clone being removed
+                close_blob_reader(repo_path)
+                remove_clone(repo_path, options)
+                clone_repository(username, repository, options)
+                continue
+            print(f"Giving up on file: {file}")
+            get_quarantine(options).add(unit, str(e))
+            return
+        get_journal(options).record(unit, DONE)
+        return
+
+def mine_file(username, repository, file, repo_path, options, history=None, deadline=None):
+    """
+    This function gets the commits for the file in a scratch workspace, in this process, or in a child process
+    bounded by the wall-clock and memory limits of the file if there are any
+    Raises LimitExceeded if the file runs out of its limits
 
-def create_differ_files():
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param file: Name of the file
+    :param repo_path: Path to the cloned repository
+    :param options: Parsed command line options
+    :param history: Version stream of the file from walk_history, if the history was walked in a single pass
+    :param deadline: Deadline of the project, see project_deadline
+    """
+    timeout = file_time_limit(options, deadline)
+    if not timeout and not options.memory_limit:
+        # the counters of the extraction cache of this process are already up to date
+        error, _ = mine_file_in_scratch(username, repository, file, os.path.abspath(repo_path), options, history)
+        if error is not None:
+            raise RuntimeError(error)
+        return
+    # a child killed for its limits never gets to remove its workspace, so this process owns it
+    workspace = TaskWorkspace()
+    try:
+        error, cache_counts = run_with_limits(mine_file_in_child, (username, repository, file, os.path.abspath(repo_path), options, history, workspace),
+                                              timeout, int(options.memory_limit * 1024 ** 3))
+    finally:
+        workspace.discard()
+    if cache_counts is not None:
+        get_extraction_cache(options).add_counts(cache_counts)
+    if error is not None:
+        raise RuntimeError(error)
+
+def create_differ_files(append=False):
     """
     This function creates the differ files
-    It finds the files that start with the prefixes: docstring_, code_, differ_
+    It finds the files that start with the prefixes: docstring_, code_, differ_ in the manifests of the `_files`
+    folders, so only the working directory is listed, not every file of the run
     It copies the files to the differ_files directory
     It extracts the differences between the consecutive versions
+
+    :param append: Whether to add the pairs to the combined files of an existing differ_files directory, as
+                   --incremental does; otherwise they are built again from the `_files` folders
     """
-    os.mkdir('differ_files')
+    produced = [os.path.join('.', folder, file) for folder in files_folders() for file in read_manifest(folder)]
+    os.makedirs('differ_files', exist_ok=True)
+    # the copies of the files of the last run already went into its combined files
+    stale = ('docstring_', 'code_', 'differ_', 'functions_') + (() if append else ('combined_diff_mapping_',))
+    for file in os.listdir('differ_files'):
+        if file.startswith(stale):
+            os.remove(os.path.join('differ_files', file))
     for prefix in ['docstring_', 'code_', 'differ_']:
-        matching_files = find_and_files('.', prefix)
+        matching_files = [path for path in produced if os.path.basename(path).startswith(prefix)]
         copy_files(matching_files)
         diff_extractor(prefix)
 
+def files_folders():
+    """
+    This function returns the `_files` folders of the working directory, see get_files_folder
+    """
+    return sorted(entry.name for entry in os.scandir('.') if entry.is_dir() and entry.name.endswith('_files')
+                  and entry.name != 'differ_files')
+
 def fix_keys(filename, code=True):
     """
     This function fixes the keys in the fixed file
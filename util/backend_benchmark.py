@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parse
+from util.history import walk_history
+from util.scheduler import gil_enabled
+
+
+def longest_histories(repo_path, count):
+    """
+    Histories of the files of the repository with the most versions
+
+    :param repo_path: Path to the cloned repository
+    :param count: Number of files
+    """
+    histories = walk_history(repo_path)
+    return sorted(histories.items(), key=lambda item: len(item[1]), reverse=True)[:count]
+
+
+def time_backend(repo_path, histories, backend, workers, chunk):
+    """
+    Extract the versions of the files with one backend, in a scratch directory
+    Returns the seconds it took and the functions of every version, to check the backends against each other
+
+    :param repo_path: Absolute path to the cloned repository
+    :param histories: (file, history) pairs to extract
+    :param backend: threads or processes
+    :param workers: Number of workers
+    :param chunk: Minimum number of versions in a range
+    """
+    options = parse.parse_arguments(['--no-checkout', '--version-workers', str(workers), '--version-chunk', str(chunk),
+                                     '--backend', backend])
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory(prefix='codocbench-benchmark-') as scratch:
+        os.chdir(scratch)
+        try:
+            start = time.perf_counter()
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                for file, history in histories:
+                    blob_reader = parse.get_blob_reader(repo_path)
+                    results.append([function for _, function in parse.extract_versions(repo_path, file, history, 1, options, blob_reader)])
+            seconds = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            parse.close_blob_readers()
+    return seconds, results
+
+
+def benchmark(repo_paths, files, workers, chunk, rounds):
+    """
+    Compare the thread and process backends of --version-workers on the files with the longest histories of the
+    repositories, and check that both extract the same functions
+
+    :param repo_paths: Paths to cloned repositories
+    :param files: Number of files per repository
+    :param workers: Number of workers
+    :param chunk: Minimum number of versions in a range
+    :param rounds: Number of runs per backend; the fastest one counts
+    """
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil_enabled() else 'disabled'}, {workers} workers")
+    print('repository,versions,threads_seconds,processes_seconds,same_output')
+    for repo_path in repo_paths:
+        repo_path = os.path.abspath(repo_path)
+        histories = longest_histories(repo_path, files)
+        times, outputs = {}, {}
+        for backend in ('threads', 'processes'):
+            runs = [time_backend(repo_path, histories, backend, workers, chunk) for _ in range(rounds)]
+            times[backend] = min(seconds for seconds, _ in runs)
+            outputs[backend] = runs[0][1]
+        versions = sum(len(history) for _, history in histories)
+        print(f"{repo_path},{versions},{times['threads']:.2f},{times['processes']:.2f},"
+              f"{outputs['threads'] == outputs['processes']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the thread and process backends of --version-workers.")
+    parser.add_argument('repo_paths', nargs='+', help="Paths to cloned repositories.")
+    parser.add_argument('--files', type=int, default=5, help="Number of files with the longest histories per repository.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of workers.")
+    parser.add_argument('--chunk', type=int, default=50, help="Minimum number of versions in a range.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of runs per backend.")
+    args = parser.parse_args()
+    benchmark(args.repo_paths, args.files, args.workers, args.chunk, args.rounds)
@@ -0,0 +1,73 @@
+import io
+import subprocess
+
+
+class BlobReader:
+    """
+    Reads file contents straight from the object database of a repository
+
+    A single long-lived `git cat-file --batch` process is kept per repository, so reading a version of a file
+    does not touch the working tree and does not spawn a new git process for every commit
+    """
+
+    def __init__(self, repo_path):
+        """
+        :param repo_path: Path to the cloned repository
+        """
+        self.repo_path = repo_path
+        self.process = subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            cwd=repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def read(self, revision):
+        """
+        Read an object from the repository
+
+        Returns the SHA and the raw bytes of the blob, or (None, None) if the object is missing or is not a blob
+
+        :param revision: Anything `git cat-file` understands, e.g. a blob SHA or <commit>:<path>
+        """
+        self.process.stdin.write(revision.encode() + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().rstrip(b'\n')
+        if header.endswith((b' missing', b' ambiguous')):
+            # "<revision> missing" or "<revision> ambiguous"; the revision may contain spaces
+            return None, None
+        sha, kind, size = header.rsplit(b' ', 2)
+        data = self.process.stdout.read(int(size))
+        # every object is followed by a newline
+        self.process.stdout.read(1)
+        if kind != b'blob':
+            return None, None
+        return sha.decode(), data
+
+    def read_file(self, commit_sha, filename):
+        """
+        Read the file as it was at the given commit
+
+        :param commit_sha: Commit SHA to read the file at
+        :param filename: Path of the file relative to the root of the repository
+        """
+        return self.read(f'{commit_sha}:{filename}')
+
+    def close(self):
+        """
+        Stop the `git cat-file` process
+        """
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+def decode_blob(data):
+    """
+    Decode the bytes of a blob the same way open(path, 'r') decodes a checked out file
+    (default encoding and universal newlines), so both modes produce the same content
+
+    :param data: Raw bytes of the blob
+    """
+    return io.TextIOWrapper(io.BytesIO(data)).read()
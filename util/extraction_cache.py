@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import tempfile
+
+EXTRACTOR_VERSION = 1  # bump when split_comments_and_code changes, so entries of the old extractor are never used
+
+
+def git_blob_sha(data):
+    """
+    SHA git gives a blob with the given content, i.e. what `git hash-object` prints for a file
+
+    :param data: Raw bytes of the blob
+    """
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Persistent cache from the SHA of a blob to what split_comments_and_code extracts from it
+
+    Identical blobs show up across commits (reverts, merges), across files (vendored copies) and across forks, and
+    each of them only has to be parsed once; the entries are laid out like loose git objects and written atomically,
+    so several processes can share the cache directory
+    Once the cache grows past its size limit, the least recently used entries are evicted
+    """
+
+    def __init__(self, cache_dir, limit_bytes=0):
+        """
+        :param cache_dir: Directory of the cache
+        :param limit_bytes: Maximum size of the cache in bytes; 0 means no limit
+        """
+        self.cache_dir = os.path.join(cache_dir, f'v{EXTRACTOR_VERSION}')
+        self.limit_bytes = limit_bytes
+        self.used_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def entry_path(self, blob_sha):
+        """
+        Path of the entry of a blob
+
+        :param blob_sha: SHA of the blob
+        """
+        return os.path.join(self.cache_dir, blob_sha[:2], f'{blob_sha[2:]}.json')
+
+    def get(self, blob_sha):
+        """
+        Look the blob up in the cache
+
+        Returns the comments, code and functions extracted from the blob, or None on a miss
+
+        :param blob_sha: SHA of the blob
+        """
+        path = self.entry_path(blob_sha)
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+            # the modification time of an entry is its last use, which the eviction goes by
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [tuple(comment) for comment in entry['comments']], entry['code'], entry['functions']
+
+    def put(self, blob_sha, comments, code, functions):
+        """
+        Store what was extracted from the blob
+
+        :param blob_sha: SHA of the blob
+        :param comments: List of comments with line numbers
+        :param code: Code of the file
+        :param functions: Dictionary of the functions
+        """
+        path = self.entry_path(blob_sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), suffix='.tmp', delete=False) as entry_file:
+            json.dump({'comments': comments, 'code': code, 'functions': functions}, entry_file)
+        os.replace(entry_file.name, path)
+
+        if self.limit_bytes:
+            if self.used_bytes is None:
+                self.used_bytes = sum(size for _, size, _ in self.entries())
+            else:
+                self.used_bytes += os.path.getsize(path)
+            if self.used_bytes > self.limit_bytes:
+                self.evict()
+
+    def entries(self):
+        """
+        Yield the path, size and last use of every entry of the cache
+        """
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # evicted by another process while walking
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is under its size limit again
+        The cache directory is rescanned, since other processes may have added or evicted entries in the meantime
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.used_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.used_bytes <= self.limit_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.used_bytes -= size
+            self.evictions += 1
+
+    def counts(self):
+        """
+        Hit, miss and eviction counters of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def add_counts(self, counts):
+        """
+        Add the counters of the cache of another process, e.g. a worker, to these ones
+
+        :param counts: Counters as returned by counts()
+        """
+        self.hits += counts['hits']
+        self.misses += counts['misses']
+        self.evictions += counts['evictions']
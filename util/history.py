@@ -0,0 +1,168 @@
+import subprocess
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+
+def commit_date_time(timestamp, iso_date):
+    """
+    Build the commit date time string the way pydriller prints `commit.committer_date`, e.g. 2021-01-01 10:00:00+01:00
+
+    :param timestamp: Committer timestamp (seconds since the epoch)
+    :param iso_date: Committer date as printed by git's %ci, e.g. 2021-01-01 10:00:00 +0100
+    """
+    offset = iso_date.rsplit(' ', 1)[1]
+    sign = -1 if offset.startswith('-') else 1
+    tz = timezone(sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5])))
+    return str(datetime.fromtimestamp(int(timestamp), tz))
+
+
+def walk_history(repo_path, pathspec='*.py'):
+    """
+    Walk the commit graph of the repository once and collect the version stream of every matching file
+
+    Every commit that touches a file is appended to the stream of that file, oldest first, together with the SHA of
+    the blob it left behind (None if the file was deleted, or did not exist under this name yet)
+    Renames found by `-M` are followed: the stream of the new path continues the stream of the old one, and the
+    versions before the rename read as missing
+    Merge commits are skipped, since `git log` shows no diff for them
+
+    This is not the per-file `git log --follow` traversal of pydriller, and the streams can differ from it: `--follow`
+    also follows a file back through the history of the file it was copied from, and it picks its renames on the
+    history of the one path, so on a non-linear history, or when a path is deleted and added again, it can keep a
+    different set of commits than this walk; the version numbers of such files differ between the two
+
+    :param repo_path: Path to the cloned repository
+    :param pathspec: Only files matching this pathspec are tracked
+    """
+    output = subprocess.run(
+        ['git', 'log', '--reverse', '--raw', '-z', '-M', '--no-abbrev',
+         '--format=%x01%H%x00%ct%x00%ci%x00%B%x00', '--', pathspec],
+        cwd=repo_path, stdout=subprocess.PIPE, check=True,
+    ).stdout
+
+    streams = {}
+    for chunk in output.split(b'\x01')[1:]:
+        commit_sha, timestamp, iso_date, message, raw = chunk.split(b'\x00', 4)
+        commit = {
+            'commit_sha': commit_sha.decode(),
+            'commit_date_time': commit_date_time(timestamp.decode(), iso_date.decode()),
+            'commit_message': message.decode('utf-8', 'replace').strip(),
+        }
+
+        tokens = raw.lstrip(b'\x00\n').split(b'\x00')
+        i = 0
+        while i < len(tokens) and tokens[i].startswith(b':'):
+            status_line = tokens[i].split()
+            new_blob = status_line[3].decode()
+            status = status_line[4].decode()
+            if status[0] in 'RC':
+                old_path, new_path = tokens[i + 1].decode(), tokens[i + 2].decode()
+                i += 3
+            else:
+                old_path = new_path = tokens[i + 1].decode()
+                i += 2
+
+            if status[0] == 'R':
+                # the file did not exist under its new name before the rename
+                streams[new_path] = [dict(version, blob_sha=None) for version in streams.pop(old_path, [])]
+            blob_sha = None if status[0] == 'D' else new_blob
+            streams.setdefault(new_path, []).append(dict(commit, blob_sha=blob_sha))
+
+    return streams
+
+
+def commits_since(repo_path, commit_sha):
+    """
+    SHAs of the commits reachable from HEAD but not from the given commit
+
+    Returns None if the commit is not in the repository anymore, e.g. after a force push
+
+    :param repo_path: Path to the cloned repository
+    :param commit_sha: Commit the previous run mined up to
+    """
+    result = subprocess.run(['git', 'rev-list', f'{commit_sha}..HEAD'], cwd=repo_path,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+    return set(result.stdout.decode().split())
+
+
+def files_matching(repo_path, pattern, pathspec='*.py'):
+    """
+    Paths of the files whose history adds or removes a line matching the regular expression (`git log -G`)
+    Every line of a version of a file was added by some commit, so a file is left out only if none of its versions
+    ever had a matching line
+
+    :param repo_path: Path to the cloned repository
+    :param pattern: Extended regular expression
+    :param pathspec: Only files matching this pathspec are searched
+    """
+    # without rename detection a renamed file is added in full under its new name, so both names are reported
+    output = subprocess.run(
+        ['git', 'log', '--no-renames', '--extended-regexp', '-G', pattern, '--name-only', '-z', '--format=', '--', pathspec],
+        cwd=repo_path, stdout=subprocess.PIPE, check=True,
+    ).stdout
+    return {path.decode() for path in output.replace(b'\n', b'\0').split(b'\0') if path}
+
+
+def docstring_candidates(repo_path, pathspec='*.py'):
+    """
+    Paths of the files that may yield a docstring change: some version of the file had a triple quote, and some
+    version had a def or a class; the docstring of every function of any other file is always empty
+
+    :param repo_path: Path to the cloned repository
+    :param pathspec: Only files matching this pathspec are searched
+    """
+    return files_matching(repo_path, '"""', pathspec) & files_matching(repo_path, '^[[:space:]]*(def|class)[[:space:]]', pathspec)
+
+
+def commit_counts(repo_path, pathspec='*.py'):
+    """
+    Number of commits that touched every matching file, from one `git log` over the repository instead of one
+    `git rev-list --count` per file; merge commits are left out, as they are in walk_history
+
+    :param repo_path: Path to the cloned repository
+    :param pathspec: Only files matching this pathspec are counted
+    """
+    output = subprocess.run(
+        ['git', 'log', '--no-renames', '--name-only', '-z', '--format=', '--', pathspec],
+        cwd=repo_path, stdout=subprocess.PIPE, check=True,
+    ).stdout
+    return Counter(path.decode() for path in output.replace(b'\n', b'\0').split(b'\0') if path)
+
+
+def blob_sizes(repo_path, commit='HEAD'):
+    """
+    Size in bytes of every file of the tree of a commit, read from the object database without checking it out
+
+    :param repo_path: Path to the cloned repository
+    :param commit: Commit whose tree is listed
+    """
+    output = subprocess.run(['git', 'ls-tree', '-r', '-l', '-z', commit], cwd=repo_path,
+                            stdout=subprocess.PIPE, check=True).stdout
+    sizes = {}
+    for entry in output.split(b'\0'):
+        if entry:
+            info, path = entry.split(b'\t', 1)
+            # submodules have no size
+            size = info.split()[3]
+            sizes[path.decode()] = int(size) if size.isdigit() else 0
+    return sizes
+
+
+def line_range_commits(repo_path, filename, line_ranges):
+    """
+    SHAs of the commits that changed some ranges of lines of the file at HEAD, found with one `git log -L` per
+    range, which follows the lines back through the history of the file
+    Returns None if git cannot follow one of the ranges
+
+    :param repo_path: Path to the cloned repository
+    :param filename: Name of the file
+    :param line_ranges: (first, last) lines of the ranges in the file at HEAD, starting at 1
+    """
+    arguments = [argument for start_line, end_line in line_ranges for argument in ('-L', f'{start_line},{end_line}:{filename}')]
+    result = subprocess.run(['git', 'log'] + arguments + ['--format=%H', '-s'],
+                            cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+    return set(result.stdout.decode().split())
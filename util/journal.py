@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+
+STARTED = 'started'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Journal:
+    """
+    Append-only journal of the state transitions of the projects and files of a run
+
+    Every transition is one JSON line, flushed and fsynced before the call returns, so after a crash the journal
+    tells exactly which units were finished: a unit is done only if its last record says so; a torn last line left
+    by the crash is ignored
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the journal file; an existing journal is replayed and appended to
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = {}
+        line = ''
+        if os.path.exists(path):
+            with open(path, 'r') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.apply(record)
+        self.file = open(path, 'a')
+        if line and not line.endswith('\n'):
+            # end the torn line, so the next record starts on a line of its own
+            self.file.write('\n')
+
+    def apply(self, record):
+        """
+        Update the state of a unit with a record
+
+        :param record: Record of the journal
+        """
+        self.states[record['unit']] = record['state']
+
+    def record(self, unit, state, error=None):
+        """
+        Append a state transition of a unit to the journal
+
+        :param unit: Key of the unit, see project_unit and file_unit
+        :param state: STARTED, DONE or FAILED
+        :param error: Error message of a failure
+        """
+        record = {'unit': unit, 'state': state, 'time': time.time()}
+        if error is not None:
+            record['error'] = error
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.apply(record)
+
+    def state(self, unit):
+        """
+        Last state of a unit, or None if the journal never saw it
+
+        :param unit: Key of the unit
+        """
+        return self.states.get(unit)
+
+    def units(self, prefix, state):
+        """
+        Keys of the units starting with the prefix whose last state is the given one
+
+        :param prefix: Prefix of the keys, e.g. the key of a file of a project without the name of the file
+        :param state: STARTED, DONE or FAILED
+        """
+        return [unit for unit, unit_state in self.states.items() if unit.startswith(prefix) and unit_state == state]
+
+    def close(self):
+        """
+        Close the journal file
+        """
+        self.file.close()
+
+
+def project_unit(username, repository):
+    """
+    Key of a project in the journal
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    """
+    return f'{username}/{repository}'
+
+
+def file_unit(username, repository, filename):
+    """
+    Key of a file of a project in the journal
+
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param filename: Name of the file
+    """
+    return f'{username}/{repository}:{filename}'
@@ -0,0 +1,195 @@
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+import time
+
+MAX_BACKOFF = 60  # seconds; the wait between two retries never grows past this
+
+
+class LimitExceeded(Exception):
+    """
+    A task ran out of its wall-clock or memory limit; retrying it would only hit the limit again
+    """
+
+
+def backoff_delay(attempt, base):
+    """
+    Seconds to wait before a retry: base, then twice as long after every failed attempt, up to MAX_BACKOFF
+
+    :param attempt: Number of attempts that failed so far, starting at 1
+    :param base: Wait before the first retry, in seconds
+    """
+    return min(base * 2 ** (attempt - 1), MAX_BACKOFF)
+
+
+def run_with_limits(target, args, timeout=0, memory_bytes=0):
+    """
+    Run target(*args) in a forked child process and return its result
+
+    The child runs in a process group of its own, so when the timeout expires the git processes it started are killed
+    together with it; its address space is capped at memory_bytes, which its git processes inherit as well
+    Raises LimitExceeded if the child runs out of time or memory, or dies, and RuntimeError with the message of any
+    other exception the target raised
+
+    :param target: Function to run; its result must be picklable
+    :param args: Arguments of the function
+    :param timeout: Wall-clock limit in seconds; 0 means no limit
+    :param memory_bytes: Address space limit in bytes; 0 means no limit
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_limited_child, args=(sender, target, args, memory_bytes))
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout or None):
+            kill_process_group(process.pid)
+            raise LimitExceeded(f'timed out after {timeout:g} seconds')
+        try:
+            status, result = receiver.recv()
+        except EOFError:
+            process.join()
+            raise LimitExceeded(f'died with exit code {process.exitcode}')
+    finally:
+        receiver.close()
+        process.join()
+    if status == 'memory':
+        raise LimitExceeded('ran out of memory')
+    if status == 'error':
+        raise RuntimeError(result)
+    return result
+
+
+def run_limited_child(sender, target, args, memory_bytes):
+    """
+    Body of the child process of run_with_limits
+
+    :param sender: End of the pipe the result is sent through
+    :param target: Function to run
+    :param args: Arguments of the function
+    :param memory_bytes: Address space limit in bytes; 0 means no limit
+    """
+    os.setpgid(0, 0)
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    try:
+        sender.send(('ok', target(*args)))
+    except MemoryError:
+        sender.send(('memory', None))
+    except Exception as e:
+        sender.send(('error', str(e)))
+    finally:
+        sender.close()
+
+
+def kill_process_group(pid):
+    """
+    Kill a process and every process of its group
+
+    :param pid: PID of the process, which leads its group
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class Quarantine:
+    """
+    List of the projects and files that failed for good, kept on disk as JSON lines
+
+    The units on the list are skipped by every later run; removing a line from the file gives the unit another chance
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the quarantine file
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.units = {}
+        line = ''
+        if os.path.exists(path):
+            with open(path, 'r') as quarantine_file:
+                for line in quarantine_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.units[entry['unit']] = entry['reason']
+        if line and not line.endswith('\n'):
+            # end the torn line, so the next entry starts on a line of its own
+            with open(path, 'a') as quarantine_file:
+                quarantine_file.write('\n')
+
+    def __contains__(self, unit):
+        return unit in self.units
+
+    def add(self, unit, reason):
+        """
+        Put a unit in quarantine
+
+        :param unit: Key of the unit, see util.journal
+        :param reason: Why the unit failed
+        """
+        with self.lock:
+            with open(self.path, 'a') as quarantine_file:
+                quarantine_file.write(json.dumps({'unit': unit, 'reason': reason, 'time': time.time()}) + '\n')
+                quarantine_file.flush()
+                os.fsync(quarantine_file.fileno())
+            self.units[unit] = reason
+
+
+class MiningBudget:
+    """
+    Budget of emitted pairs, traversed commits and seconds for mining a project
+
+    Unlike the timeouts, running out of the budget is not a failure: the files mined so far are kept, and the project
+    simply starts no new file
+    """
+
+    def __init__(self, max_pairs=0, max_commits=0, max_seconds=0):
+        """
+        :param max_pairs: Stop once this many pairs were emitted; 0 means no limit
+        :param max_commits: Stop once this many commits were traversed; 0 means no limit
+        :param max_seconds: Stop once the project ran this many seconds; 0 means no limit
+        """
+        self.max_pairs = max_pairs
+        self.max_commits = max_commits
+        self.max_seconds = max_seconds
+        self.start = time.monotonic()
+        self.pairs = 0
+        self.commits = 0
+        self.files = 0
+
+    def add(self, pairs, commits):
+        """
+        Account for a mined file
+
+        :param pairs: Number of pairs the file emitted
+        :param commits: Number of commits traversed for the file
+        """
+        self.pairs += pairs
+        self.commits += commits
+        self.files += 1
+
+    def seconds(self):
+        """
+        Seconds since the project started
+        """
+        return time.monotonic() - self.start
+
+    def exhausted(self):
+        """
+        Name of the budget that was used up: pairs, commits or seconds; None while there is budget left
+        """
+        if self.max_pairs and self.pairs >= self.max_pairs:
+            return 'pairs'
+        if self.max_commits and self.commits >= self.max_commits:
+            return 'commits'
+        if self.max_seconds and self.seconds() >= self.max_seconds:
+            return 'seconds'
+        return None
@@ -0,0 +1,76 @@
+import glob
+import os
+import subprocess
+
+
+def mirror_path(cache_dir, username, repository):
+    """
+    Path of the bare mirror of a project inside the cache
+
+    :param cache_dir: Directory of the mirror cache
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    """
+    return os.path.join(cache_dir, username, f'{repository}.git')
+
+
+def fork_candidates(cache_dir, username, repository):
+    """
+    Mirrors of the cache that are likely forks of the project, or the project it was forked from:
+    the mirrors of repositories with the same name under another owner
+
+    :param cache_dir: Directory of the mirror cache
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    """
+    own_path = mirror_path(cache_dir, username, repository)
+    return sorted(path for path in glob.glob(os.path.join(cache_dir, '*', f'{repository}.git'))
+                  if os.path.abspath(path) != os.path.abspath(own_path))
+
+
+def update_default_branch(path, url):
+    """
+    Point HEAD of the mirror at the default branch of the remote
+
+    :param path: Path to the bare mirror
+    :param url: URL of the remote
+    """
+    output = subprocess.run(['git', 'ls-remote', '--symref', url, 'HEAD'], stdout=subprocess.PIPE).stdout.decode()
+    for line in output.splitlines():
+        if line.startswith('ref: '):
+            subprocess.run(['git', 'symbolic-ref', 'HEAD', line.split()[1]], cwd=path, check=True)
+            return
+
+
+def update_mirror(cache_dir, username, repository, url, partial=False):
+    """
+    Create or update the bare mirror of a project and return its path
+
+    An existing mirror only fetches the objects that are new since the last run
+    A new mirror borrows the objects of the mirrors of its likely forks through objects/info/alternates, so the
+    history it shares with them is neither downloaded nor stored twice; the mirrors of a cache are never pruned,
+    since other mirrors may depend on their objects
+
+    :param cache_dir: Directory of the mirror cache
+    :param username: Username of the repository owner
+    :param repository: Name of the repository
+    :param url: URL of the remote
+    :param partial: Whether to leave the blobs out of the mirror (--filter=blob:none)
+    """
+    path = mirror_path(cache_dir, username, repository)
+    filter_args = ['--filter=blob:none'] if partial else []
+
+    if not os.path.exists(path):
+        subprocess.run(['git', 'init', '-q', '--bare', path], check=True)
+        subprocess.run(['git', 'remote', 'add', '--mirror=fetch', 'origin', url], cwd=path, check=True)
+        if partial:
+            subprocess.run(['git', 'config', 'remote.origin.promisor', 'true'], cwd=path, check=True)
+            subprocess.run(['git', 'config', 'remote.origin.partialclonefilter', 'blob:none'], cwd=path, check=True)
+        alternates = [os.path.abspath(os.path.join(fork, 'objects')) for fork in fork_candidates(cache_dir, username, repository)]
+        if alternates:
+            with open(os.path.join(path, 'objects', 'info', 'alternates'), 'w') as alternates_file:
+                alternates_file.write('\n'.join(alternates) + '\n')
+
+    subprocess.run(['git', 'fetch', '--prune', *filter_args, 'origin'], cwd=path, check=True)
+    update_default_branch(path, url)
+    return path
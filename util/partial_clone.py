@@ -0,0 +1,124 @@
+import os
+import subprocess
+from urllib.parse import urlparse
+
+from util.scheduler import directory_size
+
+FETCH_BATCH_SIZE = 1000  # number of blobs asked for in one fetch
+
+
+def git_output(repo_path, *args):
+    """
+    Run a git command in the repository and return its standard output
+
+    :param repo_path: Path to the repository
+    :param args: Arguments of the git command
+    """
+    return subprocess.run(['git', *args], cwd=repo_path, stdout=subprocess.PIPE, check=True).stdout.decode()
+
+
+def missing_blobs(repo_path):
+    """
+    SHAs of the blobs reachable from HEAD that were filtered out of the clone and not fetched yet
+
+    :param repo_path: Path to the partially cloned repository
+    """
+    objects = git_output(repo_path, 'rev-list', '--objects', '--missing=print', 'HEAD')
+    return {line[1:] for line in objects.splitlines() if line.startswith('?')}
+
+
+def fetch_python_blobs(repo_path, pathspec='*.py'):
+    """
+    Fetch every blob of the Python files in the history of HEAD that is missing from a partial clone, see fetch_blobs
+
+    Returns the number of blobs fetched
+
+    :param repo_path: Path to the partially cloned repository
+    :param pathspec: Files whose blobs are fetched
+    """
+    # --no-renames keeps git log from reading blob contents, which would fetch them one by one
+    raw = git_output(repo_path, 'log', '--raw', '--no-renames', '--no-abbrev', '--format=', '--', pathspec)
+    wanted = {line.split()[3] for line in raw.splitlines() if line.startswith(':')}
+    return fetch_blobs(repo_path, wanted)
+
+
+def head_python_blobs(repo_path):
+    """
+    SHAs of the blobs of the Python files in the tree of HEAD, by path; listing them never fetches a blob
+
+    :param repo_path: Path to the repository
+    """
+    entries = git_output(repo_path, 'ls-tree', '-r', '-z', 'HEAD').split('\0')
+    blobs = {}
+    for entry in entries:
+        if entry:
+            info, path = entry.split('\t', 1)
+            if info.split()[1] == 'blob' and path.endswith('.py'):
+                blobs[path] = info.split()[2]
+    return blobs
+
+
+def fetch_blobs(repo_path, wanted):
+    """
+    Fetch the given blobs that are missing from a partial clone, in batches instead of one lazy fetch per object
+    Returns the number of blobs fetched
+
+    :param repo_path: Path to the partially cloned repository
+    :param wanted: SHAs of the blobs
+    """
+    wanted = sorted(set(wanted) & missing_blobs(repo_path))
+    for start in range(0, len(wanted), FETCH_BATCH_SIZE):
+        batch = wanted[start:start + FETCH_BATCH_SIZE]
+        subprocess.run(
+            ['git', '-c', 'fetch.negotiationAlgorithm=noop', 'fetch', 'origin', '--no-tags', '--no-write-fetch-head',
+             '--recurse-submodules=no', '--filter=blob:none', '--stdin'],
+            cwd=repo_path, input='\n'.join(batch).encode() + b'\n', check=True,
+        )
+    return len(wanted)
+
+
+def object_store_size(repo_path):
+    """
+    Size in bytes of the object store of a repository, bare or not
+
+    :param repo_path: Path to the repository
+    """
+    git_dir = os.path.join(repo_path, '.git')
+    if not os.path.isdir(git_dir):
+        git_dir = repo_path
+    return directory_size(os.path.join(git_dir, 'objects'))
+
+
+def local_remote_path(repo_path):
+    """
+    Path of the origin remote if it lives on this machine (file:// URL or plain path), None otherwise
+
+    :param repo_path: Path to the cloned repository
+    """
+    url = git_output(repo_path, 'remote', 'get-url', 'origin').strip()
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return parsed.path
+    if parsed.scheme == '' and os.path.isdir(url):
+        return url
+    return None
+
+
+def partial_clone_stats(repo_path):
+    """
+    Bytes downloaded by a partial clone and, when the size of the full object store of the remote can be measured,
+    the bytes a full clone would have downloaded on top of that
+
+    Returns a dictionary with downloaded_bytes, full_bytes, saved_bytes (None when unknown) and missing_blobs
+
+    :param repo_path: Path to the partially cloned repository
+    """
+    downloaded_bytes = object_store_size(repo_path)
+    remote_path = local_remote_path(repo_path)
+    full_bytes = object_store_size(remote_path) if remote_path else None
+    return {
+        'downloaded_bytes': downloaded_bytes,
+        'full_bytes': full_bytes,
+        'saved_bytes': full_bytes - downloaded_bytes if full_bytes is not None else None,
+        'missing_blobs': len(missing_blobs(repo_path)),
+    }
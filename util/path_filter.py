@@ -0,0 +1,40 @@
+import fnmatch
+import posixpath
+
+# parts of the paths of vendored, copied and generated code, matched against the lowercase path like the FILTER_PATHS
+# of the language parsers the association fixer uses (see util/assoc_fixer.py)
+FILTER_PATHS = (
+    '/site-packages/', '/dist-packages/', '/vendor/', '/vendored/', '/_vendor/', '/third_party/', '/thirdparty/',
+    '/node_modules/', '/migrations/', '/build/lib/', '.egg-info/', '_pb2.py', '_pb2_grpc.py',
+)
+
+
+def matches(path, pattern):
+    """
+    Whether the path matches the glob pattern; a pattern without a slash is matched against the file name as well,
+    so `setup.py` matches every setup.py of the repository
+
+    :param path: Path of the file, relative to the root of the repository
+    :param pattern: Glob pattern, where * matches across directories
+    """
+    if fnmatch.fnmatchcase(path, pattern):
+        return True
+    return '/' not in pattern and fnmatch.fnmatchcase(posixpath.basename(path), pattern)
+
+
+def path_allowed(path, include=(), exclude=(), filter_paths=()):
+    """
+    Whether a file passes the path rules: it matches one of the include patterns, if there are any, none of the
+    exclude patterns, and none of the filter paths
+
+    :param path: Path of the file, relative to the root of the repository
+    :param include: Glob patterns of the files to keep
+    :param exclude: Glob patterns of the files to leave out
+    :param filter_paths: Parts of the paths to leave out, see FILTER_PATHS
+    """
+    if include and not any(matches(path, pattern) for pattern in include):
+        return False
+    if any(matches(path, pattern) for pattern in exclude):
+        return False
+    lower_path = '/' + path.lower()
+    return not any(filter_path in lower_path for filter_path in filter_paths)
@@ -0,0 +1,99 @@
+import csv
+import os
+
+# seconds it takes to mine one byte of one version of a file; used when there is no cost_model_report.csv (see --lpt)
+# to calibrate it against
+SECONDS_PER_COST = 2e-7
+# share of the changes of a documented function that change its docstring and its code together
+PAIRS_PER_DOCUMENTED_CHANGE = 0.1
+# bytes of text files and functions JSON written for one byte of one version of a file
+OUTPUT_BYTES_PER_COST = 3
+
+
+def seconds_per_cost(report_path='cost_model_report.csv'):
+    """
+    Seconds it takes to mine one byte of one version of a file, fitted on the estimated costs and the runtimes of the
+    files mined with --lpt; SECONDS_PER_COST if there is no such report yet
+
+    :param report_path: Path to the cost model report
+    """
+    if not os.path.exists(report_path):
+        return SECONDS_PER_COST
+    total_cost = total_seconds = 0
+    with open(report_path, 'r') as report_file:
+        for row in csv.DictReader(report_file):
+            if row['runtime_seconds']:
+                total_cost += int(row['estimated_cost'])
+                total_seconds += float(row['runtime_seconds'])
+    return total_seconds / total_cost if total_cost and total_seconds else SECONDS_PER_COST
+
+
+def estimate_file(commits, size_bytes, functions, documented_functions, rate):
+    """
+    Predict what mining a file yields and costs, from its metadata alone
+    Every commit after the first is a change; the pairs are expected from the changes of the functions that have a
+    docstring at HEAD, in proportion to their share of the functions of the file
+
+    :param commits: Number of commits that touched the file
+    :param size_bytes: Size of the file at HEAD
+    :param functions: Number of functions of the file at HEAD
+    :param documented_functions: Number of them that have a docstring
+    :param rate: Seconds per byte of one version, see seconds_per_cost
+    """
+    cost = max(commits, 1) * max(size_bytes, 1)
+    documented_share = documented_functions / functions if functions else 0
+    return {
+        'estimated_pairs': max(commits - 1, 0) * documented_share * PAIRS_PER_DOCUMENTED_CHANGE,
+        'predicted_seconds': cost * rate,
+        'predicted_output_bytes': cost * OUTPUT_BYTES_PER_COST,
+    }
+
+
+def write_plan(plans, path='plan.csv'):
+    """
+    Write the plan of the projects, most expensive first
+
+    :param plans: Plans of the projects, as dictionaries with the columns of the plan
+    :param path: Path to the plan
+    """
+    columns = ['owner', 'repo', 'commits', 'python_files', 'documented_files', 'python_file_commits',
+               'estimated_pairs', 'predicted_seconds', 'predicted_disk_bytes']
+    with open(path, 'w', newline='') as plan_file:
+        writer = csv.DictWriter(plan_file, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for plan in sorted(plans, key=lambda plan: plan['predicted_seconds'], reverse=True):
+            writer.writerow(dict(plan, estimated_pairs=round(plan['estimated_pairs'], 1),
+                                 predicted_seconds=round(plan['predicted_seconds'], 1)))
+
+
+def write_plan_files(rows, path='plan_files.csv'):
+    """
+    Write the metadata and predictions of every file of the planned projects
+
+    :param rows: Rows of the files
+    :param path: Path to the file
+    """
+    columns = ['owner', 'repo', 'file', 'commits', 'size_bytes', 'functions', 'documented_functions',
+               'estimated_pairs', 'predicted_seconds']
+    with open(path, 'w', newline='') as files_file:
+        writer = csv.DictWriter(files_file, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, estimated_pairs=round(row['estimated_pairs'], 2),
+                                 predicted_seconds=round(row['predicted_seconds'], 2)))
+
+
+def append_report(path, columns, rows):
+    """
+    Append rows to a CSV report that every run adds to, writing the header first if the report does not exist yet
+
+    :param path: Path to the report
+    :param columns: Names of the columns
+    :param rows: Rows to append, as lists of values in the order of the columns; None is written as an empty value
+    """
+    new_report = not os.path.exists(path)
+    with open(path, 'a', newline='') as report_file:
+        writer = csv.writer(report_file, lineterminator='\n')
+        if new_report:
+            writer.writerow(columns)
+        writer.writerows(rows)
@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+
+from util.history import blob_sizes, commit_counts
+
+
+def directory_size(path):
+    """
+    Total size in bytes of the files under the directory
+
+    :param path: Path to the directory
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                # the file was removed while walking
+                continue
+    return total
+
+
+def gil_enabled():
+    """
+    Whether the interpreter runs with the GIL; free-threaded builds (Python 3.13t and later) may run without it
+    """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled() if is_gil_enabled is not None else True
+
+
+class DiskBudget:
+    """
+    Keeps the total size of the clones on disk under a high-water mark
+
+    The size of a clone is only known once it is on disk, so no new clone is started while the clones already on disk
+    use the whole budget; a single clone is always allowed, even if it alone exceeds the budget
+    """
+
+    def __init__(self, limit_bytes):
+        """
+        :param limit_bytes: Maximum number of bytes used by the clones; 0 means no limit
+        """
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+        self.condition = threading.Condition()
+
+    def wait_for_room(self):
+        """
+        Block until a new clone may be started
+        """
+        with self.condition:
+            while self.limit_bytes and self.used_bytes and self.used_bytes >= self.limit_bytes:
+                self.condition.wait()
+
+    def add(self, size):
+        """
+        Account for a clone that is now on disk
+
+        :param size: Size of the clone in bytes
+        """
+        with self.condition:
+            self.used_bytes += size
+
+    def release(self, size):
+        """
+        Account for a clone that was deleted
+
+        :param size: Size of the clone in bytes
+        """
+        with self.condition:
+            self.used_bytes -= size
+            self.condition.notify_all()
+
+
+def file_costs(repo_path, files, histories=None):
+    """
+    Estimate the cost of mining each file as the number of commits that touched it times the size of its blob at
+    HEAD, since every commit is a version of the file that is parsed in full
+    Returns a dictionary from each file to its commit count, size in bytes and estimated cost
+
+    :param repo_path: Path to the cloned repository
+    :param files: Files to estimate
+    :param histories: Version streams of the files from walk_history; if not provided, the commits are counted with
+                      one `git log` over the repository
+    """
+    if histories is not None:
+        commits = {file: len(histories.get(file, [])) for file in files}
+    else:
+        commits = commit_counts(repo_path)
+    sizes = blob_sizes(repo_path)
+    costs = {}
+    for file in files:
+        count, size = commits.get(file, 0), sizes.get(file, 0)
+        costs[file] = {'commits': count, 'size_bytes': size, 'estimated_cost': max(count, 1) * max(size, 1)}
+    return costs
@@ -0,0 +1,137 @@
+import hashlib
+from collections import OrderedDict
+
+from util.blob_reader import decode_blob
+
+# keys split_comments_and_code and compare_versions never treat as functions, besides the metadata of the version
+NON_FUNCTION_KEYS = ('code_lines', 'docstring_lines')
+
+
+def content_hash(function):
+    """
+    Hash of the docstring and the code of a function, which two versions are compared by; which of the two changed
+    is only told apart once the function is materialized
+
+    :param function: Function, with its docstring and code
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(function['docstring'].encode('utf-8', 'surrogatepass'))
+    digest.update(b'\0')
+    digest.update(function['code'].encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def reference_version(functions, blob_sha, metadata_keys):
+    """
+    Reference record of a version: the SHA of the blob it was extracted from, the metadata of the version, and for
+    every function the lines of its docstring and code and the hash of their content, as
+    [docstring start, docstring end, code start, code end, hash], without their text
+
+    :param functions: Functions of the version, with the metadata of the version
+    :param blob_sha: SHA of the blob of the file at the commit of the version
+    :param metadata_keys: Keys of the metadata of the version, see VERSION_METADATA
+    """
+    return {
+        'blob_sha': blob_sha,
+        'metadata': {key: functions[key] for key in metadata_keys if key in functions},
+        'functions': {
+            name: [function['docstring_lines']['start_line'], function['docstring_lines']['end_line'],
+                   function['code_lines']['start_line'], function['code_lines']['end_line'], content_hash(function)]
+            for name, function in functions.items()
+            if name not in metadata_keys and name not in NON_FUNCTION_KEYS
+        },
+    }
+
+
+def changed_functions(current, following):
+    """
+    Names of the functions of a version whose docstring or code differs in the next version, in the order of the
+    version
+
+    :param current: Reference record of the version
+    :param following: Reference record of the next version
+    """
+    if current is None or following is None:
+        return []
+    changed = []
+    for name, reference in current['functions'].items():
+        next_reference = following['functions'].get(name)
+        if next_reference is None:
+            continue
+        if reference[-1] != next_reference[-1]:
+            changed.append(name)
+    return changed
+
+
+class TextMaterializer:
+    """
+    Pulls the text of the functions of reference records back out of the object database
+
+    A blob is parsed again only if it is not among the few whose functions were parsed last, and the extraction
+    cache is tried first, so materializing the versions of a pair usually costs nothing
+    """
+
+    def __init__(self, blob_reader, parse, extraction_cache=None, size=4):
+        """
+        :param blob_reader: BlobReader of the repository
+        :param parse: Function splitting the content of a file into its comments, code and functions
+        :param extraction_cache: ExtractionCache of the run, or None
+        :param size: Number of blobs whose functions are kept
+        """
+        self.blob_reader = blob_reader
+        self.parse = parse
+        self.extraction_cache = extraction_cache
+        self.size = size
+        self.parsed = OrderedDict()
+
+    def remember(self, blob_sha, functions):
+        """
+        Keep the functions just extracted from a blob, so that materializing them does not parse it again
+
+        :param blob_sha: SHA of the blob
+        :param functions: Functions extracted from the blob
+        """
+        self.parsed[blob_sha] = functions
+        self.parsed.move_to_end(blob_sha)
+        while len(self.parsed) > self.size:
+            self.parsed.popitem(last=False)
+
+    def functions(self, blob_sha):
+        """
+        Functions of a blob, from the blobs parsed last, the extraction cache or the object database
+
+        :param blob_sha: SHA of the blob
+        """
+        if blob_sha in self.parsed:
+            self.parsed.move_to_end(blob_sha)
+            return self.parsed[blob_sha]
+        extracted = self.extraction_cache.get(blob_sha) if self.extraction_cache is not None else None
+        if extracted is None:
+            _, data = self.blob_reader.read(blob_sha)
+            extracted = self.parse(decode_blob(data))
+        functions = extracted[2]
+        self.remember(blob_sha, functions)
+        return functions
+
+    def materialize(self, reference, names):
+        """
+        Version with the text of the given functions and the metadata of the version, as the functions JSON file
+        holds it
+
+        :param reference: Reference record of the version
+        :param names: Names of the functions to materialize
+        """
+        functions = self.functions(reference['blob_sha'])
+        version = {name: functions[name] for name in names}
+        version.update(reference['metadata'])
+        return version
+
+
+def is_reference(version):
+    """
+    Whether a version is a reference record rather than the functions of the version; the functions always carry
+    the SHA of their commit, a reference record only in its metadata
+
+    :param version: Version of a file
+    """
+    return 'commit_sha' not in version
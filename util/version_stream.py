@@ -0,0 +1,42 @@
+import json
+
+
+class FunctionsJsonWriter:
+    """
+    Writes the functions JSON of a file one version at a time
+
+    The file is byte for byte what json.dump(all_functions, file, indent=4) writes, without ever holding all the
+    versions in memory; without an indent, every version is written on a line of its own
+    """
+
+    def __init__(self, path, indent=4):
+        """
+        :param path: Path of the JSON file
+        :param indent: Indent of the JSON file, or None for compact lines
+        """
+        self.file = open(path, 'w')
+        self.count = 0
+        self.indent = indent
+
+    def write(self, key, value):
+        """
+        Append a version to the file
+
+        :param key: Key of the version, e.g. v3
+        :param value: Functions of the version
+        """
+        self.file.write('{\n' if self.count == 0 else ',\n')
+        if self.indent is None:
+            self.file.write(json.dumps(key) + ':' + json.dumps(value, separators=(',', ':')))
+        else:
+            # nest the indentation of the value one level deeper, as json.dump does for the values of the outer dictionary
+            padding = ' ' * self.indent
+            self.file.write(padding + json.dumps(key) + ': ' + json.dumps(value, indent=self.indent).replace('\n', '\n' + padding))
+        self.count += 1
+
+    def close(self):
+        """
+        Close the outer dictionary and the file
+        """
+        self.file.write('\n}' if self.count else '{}')
+        self.file.close()
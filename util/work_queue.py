@@ -0,0 +1,231 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkQueue:
+    """
+    Queue of the projects to mine, shared by any number of worker processes on any number of hosts
+
+    The queue is a SQLite database on a filesystem all the hosts can reach. A worker leases a project for a number of
+    seconds and renews the lease while it mines it; the project of a worker that died is leased again by another
+    worker once its lease expired. The leases go by the wall clock, so the clocks of the hosts must be in sync to
+    well within the lease time
+    Every operation opens its own connection, so a queue can be used from several threads
+    """
+
+    def __init__(self, path, lease_seconds=600):
+        """
+        :param path: Path of the database; it is created if it does not exist
+        :param lease_seconds: How long a lease lasts unless it is renewed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        with self.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                       'owner TEXT NOT NULL, repo TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, '
+                       'lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, '
+                       'PRIMARY KEY (owner, repo))')
+
+    def transaction(self):
+        """
+        Open a connection whose `with` block is one transaction, holding the write lock of the database from the
+        start so that two workers never lease the same project
+        """
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        return Transaction(db)
+
+    def add_projects(self, projects):
+        """
+        Add projects to the queue; the projects already in it are left as they are, so every worker may seed the
+        queue with the same list
+
+        :param projects: List of (username, repository) pairs
+        """
+        with self.transaction() as db:
+            db.executemany('INSERT OR IGNORE INTO tasks (owner, repo, state) VALUES (?, ?, ?)',
+                           [(username, repository, PENDING) for username, repository in projects])
+
+    def lease(self, worker, max_attempts=1):
+        """
+        Lease the next project that is pending, or whose lease expired
+        A project whose lease expired max_attempts times is failed for good instead, since a project that keeps
+        killing its worker would otherwise take down every worker in turn
+        Returns the (username, repository) pair of the project, or None once there is nothing left to lease
+
+        :param worker: ID of the worker
+        :param max_attempts: Number of attempts after which a project whose lease expired is failed for good
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute('UPDATE tasks SET state = ?, lease_expires = NULL, error = ? '
+                       'WHERE state = ? AND lease_expires < ? AND attempts >= ?',
+                       (FAILED, 'lease expired', LEASED, now, max_attempts))
+            row = db.execute('SELECT owner, repo FROM tasks WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                             'ORDER BY rowid LIMIT 1', (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 '
+                       'WHERE owner = ? AND repo = ?', (LEASED, worker, now + self.lease_seconds) + row)
+        return row
+
+    def renew(self, username, repository, worker):
+        """
+        Extend the lease of a project
+        Returns False if the worker lost the lease, i.e. it expired and another worker leased the project
+
+        :param username: Username of the repository owner
+        :param repository: Name of the repository
+        :param worker: ID of the worker
+        """
+        with self.transaction() as db:
+            renewed = db.execute('UPDATE tasks SET lease_expires = ? WHERE owner = ? AND repo = ? AND state = ? AND worker = ?',
+                                 (time.time() + self.lease_seconds, username, repository, LEASED, worker)).rowcount
+        return renewed == 1
+
+    def complete(self, username, repository, worker):
+        """
+        Mark a project as mined
+
+        :param username: Username of the repository owner
+        :param repository: Name of the repository
+        :param worker: ID of the worker
+        """
+        with self.transaction() as db:
+            db.execute('UPDATE tasks SET state = ?, worker = ?, lease_expires = NULL, error = NULL WHERE owner = ? AND repo = ?',
+                       (DONE, worker, username, repository))
+
+    def fail(self, username, repository, worker, error, max_attempts=1):
+        """
+        Give a project back after a failure; it is leased again until it failed max_attempts times
+
+        :param username: Username of the repository owner
+        :param repository: Name of the repository
+        :param worker: ID of the worker
+        :param error: Error message
+        :param max_attempts: Number of attempts after which the project is failed for good; 0 fails it right away
+        """
+        with self.transaction() as db:
+            db.execute('UPDATE tasks SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, worker = ?, '
+                       'lease_expires = NULL, error = ? WHERE owner = ? AND repo = ?',
+                       (max_attempts, PENDING, FAILED, worker, error, username, repository))
+
+    def counts(self):
+        """
+        Number of projects in every state
+        """
+        with self.transaction() as db:
+            return dict(db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+
+class Transaction:
+    """
+    Context manager of WorkQueue.transaction: BEGIN IMMEDIATE on entry, COMMIT or ROLLBACK on exit, then close
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.db.close()
+
+
+class LeaseRenewer:
+    """
+    Renews the lease of a project in a background thread for as long as its `with` block runs
+    """
+
+    def __init__(self, queue, username, repository, worker):
+        """
+        :param queue: WorkQueue the project was leased from
+        :param username: Username of the repository owner
+        :param repository: Name of the repository
+        :param worker: ID of the worker
+        """
+        self.queue = queue
+        self.project = (username, repository, worker)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        # renew well before the lease expires, so one slow renewal does not lose it
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.renew(*self.project):
+                    print(f"Lost the lease of {self.project[0]}/{self.project[1]}, another worker may mine it too")
+                    return
+            except sqlite3.Error as e:
+                print(f"Could not renew the lease of {self.project[0]}/{self.project[1]}: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+def shard_path(queue_path, worker):
+    """
+    Path a worker publishes its codocbench.jsonl to: the shards directory next to the queue
+
+    :param queue_path: Path of the queue database
+    :param worker: ID of the worker
+    """
+    name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in worker)
+    return os.path.join(os.path.dirname(os.path.abspath(queue_path)), 'shards', f'{name}.jsonl')
+
+
+def record_key(record):
+    """
+    Key of a record of codocbench.jsonl: the function of a file of a project, between two commits
+
+    :param record: Record of codocbench.jsonl
+    """
+    return (record.get('owner'), record.get('project'), record.get('file_path'), record.get('function'),
+            tuple(version.get('commit_sha') for version in record.get('version_data', [])))
+
+
+def merge_shards(shards_dir, output_path):
+    """
+    Concatenate the shards of all the workers into one codocbench.jsonl
+    A project whose lease was lost may have been mined by two workers; the records are the same, so only the first
+    one of each is kept
+    Returns the number of records written and of duplicates dropped
+
+    :param shards_dir: Directory of the shards
+    :param output_path: Path of the merged file
+    """
+    seen = set()
+    written = duplicates = 0
+    with open(output_path, 'w') as output_file:
+        for shard in sorted(os.listdir(shards_dir)):
+            if not shard.endswith('.jsonl'):
+                continue
+            with open(os.path.join(shards_dir, shard), 'r') as shard_file:
+                for line in shard_file:
+                    if not line.strip():
+                        continue
+                    key = record_key(json.loads(line))
+                    if key in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(key)
+                    output_file.write(line if line.endswith('\n') else line + '\n')
+                    written += 1
+    return written, duplicates
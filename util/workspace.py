@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+
+WORKSPACES = '.codocbench_workspaces'  # root of the scratch workspaces, inside the working directory of the run
+MANIFEST = 'manifest.jsonl'  # list of the files a task produced, kept in its `_files` folder
+
+
+class TaskWorkspace:
+    """
+    Scratch directory a file task writes its intermediate files into
+
+    The workspaces live under WORKSPACES in the working directory, on the same filesystem as the `_files` folders, so
+    the `_files` folder of a finished task is published with one rename, and a failed task is discarded with one
+    rmtree, however many files the run already produced
+    """
+
+    def __init__(self, root=WORKSPACES):
+        """
+        :param root: Directory to create the workspace in; it is created if it does not exist
+        """
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.abspath(tempfile.mkdtemp(prefix='task-', dir=root))
+
+    def adopt(self, folder):
+        """
+        Move an existing `_files` folder into the workspace, so that an incremental run can append to it
+
+        :param folder: Path to the folder
+        """
+        os.rename(folder, os.path.join(self.path, os.path.basename(folder)))
+
+    def publish(self, folder, destination='.'):
+        """
+        Write the manifest of the `_files` folder the task left in the workspace, move the folder into the
+        destination, and remove the workspace; a task may leave no folder, e.g. an incremental one without new commits
+
+        :param folder: Name of the `_files` folder
+        :param destination: Directory to move the folder into
+        """
+        source = os.path.join(self.path, folder)
+        if os.path.isdir(source):
+            write_manifest(source)
+            os.rename(source, os.path.join(destination, folder))
+        self.discard()
+
+    def discard(self):
+        """
+        Remove the workspace with everything the task wrote into it
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def write_manifest(folder):
+    """
+    Write the manifest of a `_files` folder: one line with the name and size of each of its files
+
+    :param folder: Path to the folder
+    """
+    with open(os.path.join(folder, MANIFEST), 'w') as manifest_file:
+        for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+            if entry.name != MANIFEST and entry.is_file():
+                manifest_file.write(json.dumps({'file': entry.name, 'bytes': entry.stat().st_size}) + '\n')
+
+
+def read_manifest(folder):
+    """
+    Names of the files of a `_files` folder, from its manifest; from the folder itself if it has no manifest, like
+    the folders of the runs before the workspaces
+
+    :param folder: Path to the folder
+    """
+    manifest_path = os.path.join(folder, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return sorted(file for file in os.listdir(folder) if file != MANIFEST)
+    with open(manifest_path, 'r') as manifest_file:
+        return [json.loads(line)['file'] for line in manifest_file if line.strip()]